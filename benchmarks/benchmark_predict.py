@@ -0,0 +1,335 @@
+"""
+Measures the wrapper's own overhead against the fake ComfyUI server.
+
+Runs Predictor setup and predict end to end and reports per-phase latency
+percentiles, then runs ComfyUI clients at each concurrency level and reports
+requests per second. Weights are never downloaded.
+
+    python benchmarks/benchmark_predict.py --iterations 50 --output results.json
+    python benchmarks/benchmark_predict.py --compare baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import platform
+import subprocess
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(REPO_ROOT)
+
+from fake_comfyui_server import FakeComfyUIServer  # noqa: E402
+
+PHASES = [
+    "cleanup",
+    "input staging",
+    "analysis",
+    "queue",
+    "wait",
+    "output collection",
+    "encoding",
+    "total",
+]
+
+
+class PhaseTimer:
+    """
+    Times named phases per thread. Nested phases are exclusive, e.g. input
+    staging inside load_workflow is not also counted as analysis.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def _state(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+            self.local.current = defaultdict(float)
+        return self.local
+
+    def begin(self):
+        self._state().current = defaultdict(float)
+
+    def end(self):
+        state = self._state()
+        with self.lock:
+            for phase, seconds in state.current.items():
+                self.samples[phase].append(seconds)
+
+    def record(self, phase, seconds):
+        self._state().current[phase] += seconds
+
+    def run(self, phase, fn, *args, **kwargs):
+        state = self._state()
+        state.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = state.stack.pop()
+            state.current[phase] += elapsed - children
+            if state.stack:
+                state.stack[-1] += elapsed
+
+    def wrap(self, owner, name, phase):
+        original = getattr(owner, name)
+
+        if inspect.isgeneratorfunction(original):
+            # Only time inside the generator, not the consumer between events
+            def wrapper(*args, **kwargs):
+                generator = original(*args, **kwargs)
+                try:
+                    while True:
+                        try:
+                            item = self.run(phase, next, generator)
+                        except StopIteration:
+                            return
+                        yield item
+                finally:
+                    generator.close()
+
+        else:
+
+            def wrapper(*args, **kwargs):
+                return self.run(phase, original, *args, **kwargs)
+
+        setattr(owner, name, wrapper)
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": at(0.5),
+        "p90_ms": at(0.9),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def patch_for_fake_server(timer, port):
+    import predict
+    from comfyui import ComfyUI
+    from weights_downloader import WeightsDownloader
+    from cog_model_helpers import optimise_images
+
+    # The fake server is already listening, and weights are never downloaded
+    ComfyUI.run_server = lambda self, output_directory, input_directory: None
+    ComfyUI.install_wrapper_nodes = lambda self: None
+    WeightsDownloader.download_if_not_exists = lambda self, weight_str, url, dest: None
+
+    # Predictor hardcodes ComfyUI's default address
+    init = ComfyUI.__init__
+    ComfyUI.__init__ = lambda self, server_address: init(self, f"127.0.0.1:{port}")
+
+    timer.wrap(ComfyUI, "cleanup", "cleanup")
+    timer.wrap(predict.Predictor, "_handle_input_file", "input staging")
+    timer.wrap(ComfyUI, "handle_inputs", "input staging")
+    timer.wrap(ComfyUI, "load_workflow", "analysis")
+    timer.wrap(ComfyUI, "queue_prompt", "queue")
+    timer.wrap(ComfyUI, "stream_prompt_events", "wait")
+    timer.wrap(ComfyUI, "get_history", "output collection")
+    timer.wrap(ComfyUI, "get_files", "output collection")
+    timer.wrap(predict.Predictor, "_optimise_output_files", "encoding")
+    timer.wrap(optimise_images, "save_raw_image", "encoding")
+    return predict
+
+
+def predict_inputs(predictor, overrides):
+    # Input() defaults are field objects, so resolve them to their values
+    inputs = {}
+    for name, parameter in inspect.signature(predictor.predict).parameters.items():
+        inputs[name] = getattr(parameter.default, "default", parameter.default)
+    inputs.update(overrides)
+    return inputs
+
+
+def benchmark_predict(predict, timer, iterations, warmup, overrides):
+    from cog import Path
+
+    setup_start = time.perf_counter()
+    predictor = predict.Predictor()
+    setup_seconds = time.perf_counter() - setup_start
+
+    inputs = predict_inputs(predictor, {"image": Path("image.jpg"), **overrides})
+    for index in range(warmup + iterations):
+        timer.begin()
+        start = time.perf_counter()
+        list(predictor.predict(**{**inputs, "seed": index}))
+        timer.record("total", time.perf_counter() - start)
+        if index >= warmup:
+            timer.end()
+
+    # A repeat of the last request is cached by ComfyUI up to the output
+    # nodes, which must still produce files. Not timed.
+    if warmup + iterations:
+        outputs = list(predictor.predict(**{**inputs, "seed": warmup + iterations - 1}))
+        if not outputs:
+            raise RuntimeError("A repeated request returned no outputs")
+
+    return predictor, setup_seconds
+
+
+def benchmark_throughput(predictor, concurrency, requests):
+    # Drives the ComfyUI client directly, since a Predictor owns its
+    # directories and runs one prediction at a time
+    from comfyui import ComfyUI
+
+    clients = []
+    for _ in range(concurrency):
+        client = ComfyUI(predictor.comfyUI.server_address)
+        client.input_directory = predictor.comfyUI.input_directory
+        client.output_directory = predictor.comfyUI.output_directory
+        client.validator = predictor.comfyUI.validator
+        client.connect()
+        clients.append(client)
+
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def worker(client):
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            workflow = client.load_workflow(predictor.template.render(seed=index))
+            for _ in client.run_workflow_stream(workflow):
+                pass
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, clients))
+    seconds = time.perf_counter() - start
+
+    for client in clients:
+        client.ws.close()
+    return {"requests": requests, "seconds": seconds, "rps": requests / seconds}
+
+
+def compare(results, baseline):
+    print(f"\nComparing {results['version']} against {baseline['version']}")
+    print(f"{'phase':<20}{'p50 before':>12}{'p50 after':>12}{'change':>10}")
+    for phase in PHASES:
+        before = baseline["phases"].get(phase)
+        after = results["phases"].get(phase)
+        if not before or not after:
+            continue
+        change = (after["p50_ms"] - before["p50_ms"]) / max(before["p50_ms"], 1e-9)
+        print(
+            f"{phase:<20}{before['p50_ms']:>10.2f}ms{after['p50_ms']:>10.2f}ms{change:>+9.1%}"
+        )
+
+    print(f"\n{'concurrency':<20}{'rps before':>12}{'rps after':>12}{'change':>10}")
+    for level, after in results["throughput"].items():
+        before = baseline["throughput"].get(level)
+        if not before:
+            continue
+        change = (after["rps"] - before["rps"]) / before["rps"]
+        print(f"{level:<20}{before['rps']:>12.2f}{after['rps']:>12.2f}{change:>+9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--concurrency", default="1,2,4,8")
+    parser.add_argument("--throughput-requests", type=int, default=40)
+    parser.add_argument(
+        "--node-timings",
+        default="{}",
+        help='Seconds per class_type on the fake server, e.g. \'{"KSampler": 0.5}\'',
+    )
+    parser.add_argument(
+        "--inputs", default="{}", help="JSON predict inputs, e.g. '{\"output_format\": \"png\"}'"
+    )
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--output", help="Write results JSON to this path")
+    parser.add_argument("--compare", help="Results JSON from a previous version")
+    args = parser.parse_args()
+
+    timer = PhaseTimer()
+    predict = patch_for_fake_server(timer, args.port)
+    server = FakeComfyUIServer(
+        port=args.port,
+        output_directory=predict.OUTPUT_DIR,
+        node_timings=json.loads(args.node_timings),
+    ).start()
+
+    try:
+        predictor, setup_seconds = benchmark_predict(
+            predict, timer, args.iterations, args.warmup, json.loads(args.inputs)
+        )
+        throughput = {}
+        for level in [int(level) for level in args.concurrency.split(",")]:
+            throughput[str(level)] = benchmark_throughput(
+                predictor, level, args.throughput_requests
+            )
+    finally:
+        server.stop()
+
+    results = {
+        "version": git_version(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "config": {
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "node_timings": json.loads(args.node_timings),
+            "inputs": json.loads(args.inputs),
+        },
+        "setup_seconds": setup_seconds,
+        "phases": {
+            phase: percentiles(timer.samples[phase])
+            for phase in PHASES
+            if timer.samples[phase]
+        },
+        "throughput": throughput,
+    }
+
+    print(f"\nSetup: {setup_seconds:.2f}s")
+    print(f"{'phase':<20}{'p50':>10}{'p90':>10}{'p99':>10}")
+    for phase, stats in results["phases"].items():
+        print(
+            f"{phase:<20}{stats['p50_ms']:>8.2f}ms{stats['p90_ms']:>8.2f}ms{stats['p99_ms']:>8.2f}ms"
+        )
+    for level, stats in throughput.items():
+        print(f"Concurrency {level}: {stats['rps']:.2f} requests/s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Times workflow analysis on synthetic graphs of increasing size, to catch
+work that grows faster than the number of nodes.
+
+For each node count, reports the time and peak traced memory of
+load_workflow, handle_weights, handle_inputs, apply_helper_methods,
+randomise_seeds and the workflow optimiser passes, and the scaling exponent
+between the smallest and largest graphs (1.0 is linear). Nothing is
+downloaded: weight downloads are skipped and URL inputs are pre-created.
+
+    python benchmarks/benchmark_workflow_analysis.py --sizes 100,1000,5000,20000
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import contextlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(REPO_ROOT)
+
+from synthetic_workflows import generate_workflow, url_inputs  # noqa: E402
+
+# Flag anything that grows faster than this between the smallest and largest graph
+SUPER_LINEAR_EXPONENT = 1.3
+
+
+def analysis_benchmarks(comfyUI):
+    import workflow_optimiser
+    from node import Node
+
+    def apply_helper_methods(workflow):
+        weights_to_download = []
+        for node in workflow.values():
+            comfyUI.apply_helper_methods("add_weights", weights_to_download, Node(node))
+            comfyUI.apply_helper_methods("check_for_unsupported_nodes", Node(node))
+
+    # Each benchmark gets its own shallow copy, as some replace nodes
+    return {
+        "load_workflow": lambda wf: comfyUI.load_workflow(dict(wf)),
+        "handle_weights": lambda wf: comfyUI.handle_weights(wf),
+        "handle_inputs": lambda wf: comfyUI.handle_inputs(dict(wf)),
+        "apply_helper_methods": apply_helper_methods,
+        "randomise_seeds": lambda wf: comfyUI.randomise_seeds(wf),
+        "prune_unreachable_nodes": workflow_optimiser.prune_unreachable_nodes,
+        "merge_duplicate_nodes": workflow_optimiser.merge_duplicate_nodes,
+    }
+
+
+def measure(fn, workflow, repeats):
+    # Analysis prints per node, and that output is part of what's measured
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn(workflow)
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn(workflow)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+
+    return {
+        "median_seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "peak_memory_mb": peak / (1024 * 1024),
+    }
+
+
+def scaling_exponent(small_count, small_seconds, large_count, large_seconds):
+    if small_seconds <= 0 or large_count == small_count:
+        return None
+    return math.log(large_seconds / small_seconds) / math.log(large_count / small_count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sizes", default="100,1000,5000,20000")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", help="Comma separated benchmark names to run")
+    parser.add_argument("--output", help="Write results JSON to this path")
+    args = parser.parse_args()
+
+    from comfyui import ComfyUI
+    from weights_downloader import WeightsDownloader
+
+    WeightsDownloader.download_if_not_exists = lambda self, weight_str, url, dest: None
+    comfyUI = ComfyUI("127.0.0.1:8188")
+    comfyUI.input_directory = tempfile.mkdtemp(prefix="synthetic_inputs_")
+
+    benchmarks = analysis_benchmarks(comfyUI)
+    if args.only:
+        benchmarks = {name: benchmarks[name] for name in args.only.split(",")}
+
+    results = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        workflow = generate_workflow(size)
+        for url in url_inputs(workflow):
+            open(os.path.join(comfyUI.input_directory, os.path.basename(url)), "w").close()
+
+        node_count = len(workflow)
+        print(f"\n{node_count} nodes")
+        for name, fn in benchmarks.items():
+            stats = measure(fn, workflow, args.repeats)
+            stats["microseconds_per_node"] = stats["median_seconds"] / node_count * 1e6
+            results.setdefault(name, {})[node_count] = stats
+            print(
+                f"  {name:<26}{stats['median_seconds'] * 1000:>10.1f}ms"
+                f"{stats['microseconds_per_node']:>10.1f}us/node"
+                f"{stats['peak_memory_mb']:>10.1f}MB peak"
+            )
+
+    print("\nScaling from smallest to largest graph")
+    for name, by_count in results.items():
+        counts = sorted(by_count)
+        exponent = scaling_exponent(
+            counts[0],
+            by_count[counts[0]]["median_seconds"],
+            counts[-1],
+            by_count[counts[-1]]["median_seconds"],
+        )
+        by_count["scaling_exponent"] = exponent
+        if exponent is None:
+            continue
+        warning = "  <- super-linear" if exponent > SUPER_LINEAR_EXPONENT else ""
+        print(f"  {name:<26}n^{exponent:.2f}{warning}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+"""
+A stand-in ComfyUI server for measuring the wrapper without a GPU.
+
+It speaks enough of ComfyUI's API for the wrapper to run end to end:
+HTTP /prompt, /history, /queue, /interrupt, /free and /cog/preview_method,
+plus the /ws websocket. Queued prompts are "executed" one at a time by
+replaying ComfyUI's websocket events with configurable per-class node
+timings, and output nodes write PNG files to the output directory (or send
+raw frames, for CogSaveImageWebsocket).
+"""
+
+import os
+import re
+import ast
+import json
+import time
+import uuid
+import zlib
+import base64
+import struct
+import hashlib
+import threading
+import queue
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WEBSOCKET_TEXT = 0x1
+WEBSOCKET_BINARY = 0x2
+WEBSOCKET_CLOSE = 0x8
+OUTPUT_NODE_CLASSES = ["SaveImage", "CogSaveImage", "CogSaveImageWebsocket"]
+WRAPPER_NODES_PATH = os.path.join(os.path.dirname(__file__), "..", "cog_comfyui_nodes")
+
+# Binary event types, as in comfyui.py
+PREVIEW_IMAGE_EVENT = 1
+PREVIEW_IMAGE_PNG = 2
+RAW_IMAGE_EVENT = 0x434F47
+
+
+def gradient_pixels(width, height):
+    return b"".join(
+        bytes((x * 255 // width, y * 255 // height, 128))
+        for y in range(height)
+        for x in range(width)
+    )
+
+
+def png_bytes(width, height, pixels):
+    # Written without PIL so the server has no dependencies
+    stride = width * 3
+    rows = b"".join(
+        b"\x00" + pixels[y * stride : (y + 1) * stride] for y in range(height)
+    )
+
+    def chunk(tag, data):
+        return (
+            struct.pack(">I", len(data))
+            + tag
+            + data
+            + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+        )
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+def websocket_frame(payload, opcode=WEBSOCKET_TEXT):
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 2**16:
+        header += bytes([126]) + struct.pack(">H", length)
+    else:
+        header += bytes([127]) + struct.pack(">Q", length)
+    return header + payload
+
+
+def never_cached_classes(nodes_path=WRAPPER_NODES_PATH):
+    # Our nodes that define IS_CHANGED return time.time(), so ComfyUI never
+    # caches them. Read from the source, as the nodes need ComfyUI to import.
+    classes = set()
+    for filename in os.listdir(nodes_path):
+        if not filename.endswith(".py"):
+            continue
+        with open(os.path.join(nodes_path, filename), "r") as f:
+            tree = ast.parse(f.read())
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef) and any(
+                isinstance(item, ast.FunctionDef) and item.name == "IS_CHANGED"
+                for item in node.body
+            ):
+                classes.add(node.name)
+    return classes
+
+
+def execution_order(workflow):
+    order = []
+    visited = set()
+
+    def visit(node_id):
+        if node_id in visited or node_id not in workflow:
+            return
+        visited.add(node_id)
+        for value in workflow[node_id].get("inputs", {}).values():
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                visit(value[0])
+        order.append(node_id)
+
+    for node_id in workflow:
+        visit(node_id)
+    return order
+
+
+class FakeComfyUIServer:
+    def __init__(
+        self,
+        address="127.0.0.1",
+        port=8188,
+        output_directory="/tmp/outputs",
+        node_timings=None,
+        sampler_steps=4,
+        output_size=(512, 512),
+    ):
+        """
+        node_timings maps class_type to seconds spent "executing" a node,
+        with a "default" entry for every other class.
+        """
+        self.address = address
+        self.port = port
+        self.output_directory = output_directory
+        self.node_timings = {"default": 0.0, **(node_timings or {})}
+        self.sampler_steps = sampler_steps
+        self.output_size = output_size
+        self.output_pixels = gradient_pixels(*output_size)
+        self.output_png = png_bytes(*output_size, self.output_pixels)
+
+        self.clients = {}
+        self.history = {}
+        self.prompts = queue.Queue()
+        self.deleted_prompts = set()
+        self.interrupted = threading.Event()
+        self.running_prompt_id = None
+        # Set by the wrapper through /cog/preview_method, off by default
+        self.preview_method = "none"
+        self.cache = {}
+        self.ui_outputs = {}
+        self.never_cached = never_cached_classes()
+        self.lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((address, port), self._handler())
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        threading.Thread(target=self._execute_prompts, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def send(self, client_id, message_type, data):
+        self._send_raw(client_id, json.dumps({"type": message_type, "data": data}).encode())
+
+    def _send_raw(self, client_id, payload, opcode=WEBSOCKET_TEXT):
+        client = self.clients.get(client_id)
+        if client is None:
+            return
+        connection, lock = client
+        try:
+            with lock:
+                connection.sendall(websocket_frame(payload, opcode))
+        except OSError:
+            self.clients.pop(client_id, None)
+
+    def send_binary(self, client_id, event_type, payload):
+        self._send_raw(
+            client_id, struct.pack(">I", event_type) + payload, opcode=WEBSOCKET_BINARY
+        )
+
+    def _send_raw_image(self, client_id, node_id, prefix):
+        width, height = self.output_size
+        header = json.dumps(
+            {
+                "node": node_id,
+                "index": 0,
+                "width": width,
+                "height": height,
+                "channels": 3,
+                "filename_prefix": prefix,
+            }
+        ).encode("utf-8")
+        self.send_binary(
+            client_id,
+            RAW_IMAGE_EVENT,
+            struct.pack(">I", len(header)) + header + self.output_pixels,
+        )
+
+    def _node_time(self, class_type):
+        return self.node_timings.get(class_type, self.node_timings["default"])
+
+    def _write_output(self, prefix):
+        # Like ComfyUI, the counter continues from the files already saved
+        # with this prefix in this subfolder
+        subfolder, name = os.path.split(prefix)
+        directory = os.path.join(self.output_directory, subfolder)
+        with self.lock:
+            os.makedirs(directory, exist_ok=True)
+            pattern = re.compile(rf"^{re.escape(name)}_(\d+)_")
+            counters = [
+                int(match.group(1))
+                for match in map(pattern.match, os.listdir(directory))
+                if match
+            ]
+            filename = f"{name}_{max(counters, default=0) + 1:05d}_.png"
+            with open(os.path.join(directory, filename), "wb") as f:
+                f.write(self.output_png)
+        return {"filename": filename, "subfolder": subfolder, "type": "output"}
+
+    def _execute_prompts(self):
+        while True:
+            prompt_id, client_id, workflow = self.prompts.get()
+            if prompt_id in self.deleted_prompts:
+                continue
+            self.interrupted.clear()
+            self.running_prompt_id = prompt_id
+            self._execute(prompt_id, client_id, workflow)
+            self.running_prompt_id = None
+
+    def _execute(self, prompt_id, client_id, workflow):
+        self.send(client_id, "execution_start", {"prompt_id": prompt_id})
+
+        # Like ComfyUI, nodes whose inputs and upstream nodes match the last
+        # run are cached, output nodes included
+        order = execution_order(workflow)
+        signatures = {}
+        for node_id in order:
+            node = workflow[node_id]
+            upstream = [
+                signatures.get(value[0])
+                for value in node.get("inputs", {}).values()
+                if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str)
+            ]
+            signatures[node_id] = json.dumps([node, upstream], sort_keys=True)
+        cached = [
+            node_id
+            for node_id in order
+            if self.cache.get(node_id) == signatures[node_id]
+            and workflow[node_id]["class_type"] not in self.never_cached
+        ]
+        self.send(client_id, "execution_cached", {"nodes": cached, "prompt_id": prompt_id})
+
+        # Cached output nodes only appear in the history, with their last output
+        outputs = {
+            node_id: self.ui_outputs[node_id]
+            for node_id in cached
+            if node_id in self.ui_outputs
+        }
+        for node_id in order:
+            if node_id in cached:
+                continue
+            if self.interrupted.is_set():
+                self.send(client_id, "execution_interrupted", {"prompt_id": prompt_id, "node_id": node_id})
+                break
+
+            node = workflow[node_id]
+            class_type = node.get("class_type")
+            self.send(client_id, "executing", {"node": node_id, "prompt_id": prompt_id})
+
+            node_time = self._node_time(class_type)
+            if "seed" in node.get("inputs", {}) and self.sampler_steps:
+                for step in range(1, self.sampler_steps + 1):
+                    time.sleep(node_time / self.sampler_steps)
+                    if self.preview_method != "none":
+                        self.send_binary(
+                            client_id,
+                            PREVIEW_IMAGE_EVENT,
+                            struct.pack(">I", PREVIEW_IMAGE_PNG) + self.output_png,
+                        )
+                    self.send(
+                        client_id,
+                        "progress",
+                        {"value": step, "max": self.sampler_steps, "prompt_id": prompt_id, "node": node_id},
+                    )
+            else:
+                time.sleep(node_time)
+
+            if class_type == "CogSaveImageWebsocket":
+                prefix = node["inputs"].get("filename_prefix", "ComfyUI")
+                self._send_raw_image(client_id, node_id, prefix)
+                self.send(
+                    client_id,
+                    "executed",
+                    {"node": node_id, "display_node": node_id, "output": {}, "prompt_id": prompt_id},
+                )
+            elif class_type in OUTPUT_NODE_CLASSES:
+                prefix = node["inputs"].get("filename_prefix", "ComfyUI")
+                output = {"images": [self._write_output(prefix)]}
+                outputs[node_id] = output
+                self.ui_outputs[node_id] = output
+                self.send(
+                    client_id,
+                    "executed",
+                    {"node": node_id, "display_node": node_id, "output": output, "prompt_id": prompt_id},
+                )
+            self.cache[node_id] = signatures[node_id]
+
+        self.history[prompt_id] = {"prompt": [], "outputs": outputs, "status": {}}
+        self.send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, data, status=200):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length)) if length else {}
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/ws":
+                    return self._websocket(parse_qs(url.query).get("clientId", [""])[0])
+                if url.path.startswith("/history/"):
+                    prompt_id = url.path.split("/")[-1]
+                    entry = server.history.get(prompt_id)
+                    return self._json({prompt_id: entry} if entry else {})
+                if url.path == "/queue":
+                    return self._json(
+                        {
+                            "queue_running": [[0, server.running_prompt_id]] if server.running_prompt_id else [],
+                            "queue_pending": [[0, p[0]] for p in list(server.prompts.queue)],
+                        }
+                    )
+                self._json({"error": "not found"}, 404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                data = self._body()
+                if url.path == "/prompt":
+                    prompt_id = str(uuid.uuid4())
+                    server.prompts.put((prompt_id, data.get("client_id"), data["prompt"]))
+                    return self._json({"prompt_id": prompt_id, "number": 0, "node_errors": {}})
+                if url.path == "/queue":
+                    if data.get("clear"):
+                        while not server.prompts.empty():
+                            server.prompts.get_nowait()
+                    server.deleted_prompts.update(data.get("delete", []))
+                    return self._json({})
+                if url.path == "/interrupt":
+                    server.interrupted.set()
+                    return self._json({})
+                if url.path == "/history":
+                    for prompt_id in data.get("delete", []):
+                        server.history.pop(prompt_id, None)
+                    if data.get("clear"):
+                        server.history.clear()
+                    return self._json({})
+                if url.path == "/free":
+                    server.cache.clear()
+                    return self._json({})
+                if url.path == "/cog/preview_method":
+                    server.preview_method = data.get("method", "none")
+                    return self._json({"method": server.preview_method})
+                self._json({"error": "not found"}, 404)
+
+            def _websocket(self, client_id):
+                key = self.headers["Sec-WebSocket-Key"]
+                accept = base64.b64encode(
+                    hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+                ).decode()
+                self.send_response(101)
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                self.wfile.flush()
+
+                server.clients[client_id] = (self.connection, threading.Lock())
+                server.send(client_id, "status", {"status": {"exec_info": {"queue_remaining": 0}}, "sid": client_id})
+                # Hold the connection open until the client closes it
+                try:
+                    while self._read_frame() != WEBSOCKET_CLOSE:
+                        pass
+                    server._send_raw(client_id, b"", opcode=WEBSOCKET_CLOSE)
+                except (OSError, ConnectionError):
+                    pass
+                server.clients.pop(client_id, None)
+                self.close_connection = True
+
+            def _read_frame(self):
+                # Client frames are always masked
+                header = self.rfile.read(2)
+                if len(header) < 2:
+                    raise ConnectionError("Websocket closed")
+                opcode = header[0] & 0x0F
+                length = header[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", self.rfile.read(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", self.rfile.read(8))[0]
+                self.rfile.read(4 + length)
+                return opcode
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake ComfyUI server")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--output-directory", default="/tmp/outputs")
+    parser.add_argument(
+        "--node-timings",
+        default="{}",
+        help='JSON mapping class_type to seconds, e.g. \'{"KSampler": 2, "default": 0.05}\'',
+    )
+    args = parser.parse_args()
+
+    FakeComfyUIServer(
+        port=args.port,
+        output_directory=args.output_directory,
+        node_timings=json.loads(args.node_timings),
+    ).start()
+    print(f"Fake ComfyUI server listening on 127.0.0.1:{args.port}")
+    while True:
+        time.sleep(3600)
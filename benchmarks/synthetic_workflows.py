@@ -0,0 +1,136 @@
+"""
+Generates large API-format workflows for benchmarking workflow analysis.
+
+Workflows are built from blocks of real node types that the custom node
+helpers act on: checkpoint and LoRA loaders, prompts with embeddings,
+IPAdapter loaders, AIO_Preprocessor, RemBGSession+, LayerDiffuse and
+LoadImage nodes with URL inputs. Some blocks take their image from an
+earlier block, so graphs are deep as well as wide.
+"""
+
+import random
+
+CHECKPOINTS = [
+    "realvisxlV40_v40Bakedvae.safetensors",
+    "512-inpainting-ema.safetensors",
+    "AAM_XL_Anime_Mix.safetensors",
+]
+LORAS = ["3d_render_style_xl.safetensors", "add-detail-xl.safetensors"]
+EMBEDDINGS = ["embedding:easynegative", "embedding:epiCNegative"]
+IPADAPTER_PRESETS = ["STANDARD (medium strength)", "PLUS (high strength)"]
+PREPROCESSORS = ["Zoe-DepthMapPreprocessor", "DepthAnythingPreprocessor", "CannyEdgePreprocessor"]
+REMBG_MODELS = ["u2net: general purpose", "isnet-general-use: general purpose"]
+LAYER_DIFFUSION_CONFIGS = ["SDXL, Attention Injection", "SDXL, Conv Injection"]
+
+# Every block adds this many nodes
+BLOCK_SIZE = 14
+
+
+def url_input(index):
+    return f"https://example.com/inputs/image_{index}.png"
+
+
+def add_block(workflow, index, rng, upstream_image=None):
+    def node_id(offset):
+        return str(index * BLOCK_SIZE + offset)
+
+    def add(offset, class_type, inputs):
+        workflow[node_id(offset)] = {
+            "inputs": inputs,
+            "class_type": class_type,
+            "_meta": {"title": class_type},
+        }
+        return node_id(offset)
+
+    checkpoint = add(0, "CheckpointLoaderSimple", {"ckpt_name": rng.choice(CHECKPOINTS)})
+    lora = add(
+        1,
+        "LoraLoader",
+        {
+            "lora_name": rng.choice(LORAS),
+            "strength_model": 1.0,
+            "strength_clip": 1.0,
+            "model": [checkpoint, 0],
+            "clip": [checkpoint, 1],
+        },
+    )
+    positive = add(
+        2, "CLIPTextEncode", {"text": f"a photo, block {index}", "clip": [lora, 1]}
+    )
+    negative = add(
+        3,
+        "CLIPTextEncode",
+        {"text": f"ugly, {rng.choice(EMBEDDINGS)}", "clip": [lora, 1]},
+    )
+    image = upstream_image or [
+        add(4, "LoadImage", {"image": url_input(rng.randrange(index + 1))}),
+        0,
+    ]
+    ipadapter = add(
+        5,
+        "IPAdapterUnifiedLoader",
+        {"preset": rng.choice(IPADAPTER_PRESETS), "model": [lora, 0]},
+    )
+    preprocessor = add(
+        6,
+        "AIO_Preprocessor",
+        {"preprocessor": rng.choice(PREPROCESSORS), "resolution": 512, "image": image},
+    )
+    rembg_session = add(
+        7,
+        "RemBGSession+",
+        {"model": rng.choice(REMBG_MODELS), "providers": "CUDA"},
+    )
+    rembg = add(
+        8, "ImageRemoveBackground+", {"rembg_session": [rembg_session, 0], "image": [preprocessor, 0]}
+    )
+    layer_diffusion = add(
+        9,
+        "LayeredDiffusionApply",
+        {"config": rng.choice(LAYER_DIFFUSION_CONFIGS), "weight": 1.0, "model": [ipadapter, 0]},
+    )
+    latent = add(10, "VAEEncode", {"pixels": [rembg, 0], "vae": [checkpoint, 2]})
+    sampler = add(
+        11,
+        "KSampler",
+        {
+            "seed": rng.randrange(2**32),
+            "steps": 20,
+            "cfg": 7.0,
+            "sampler_name": "euler",
+            "scheduler": "normal",
+            "denoise": 0.8,
+            "model": [layer_diffusion, 0],
+            "positive": [positive, 0],
+            "negative": [negative, 0],
+            "latent_image": [latent, 0],
+        },
+    )
+    decoded = add(12, "VAEDecode", {"samples": [sampler, 0], "vae": [checkpoint, 2]})
+    add(13, "SaveImage", {"filename_prefix": f"block_{index}", "images": [decoded, 0]})
+    return [decoded, 0]
+
+
+def generate_workflow(node_count, seed=0, chain_fraction=0.25):
+    """
+    Returns a workflow of about node_count nodes. chain_fraction of the
+    blocks use the previous block's output as their input image.
+    """
+    rng = random.Random(seed)
+    workflow = {}
+    previous_image = None
+    for index in range(max(1, node_count // BLOCK_SIZE)):
+        chained = previous_image if rng.random() < chain_fraction else None
+        previous_image = add_block(workflow, index, rng, chained)
+    return workflow
+
+
+def url_inputs(workflow):
+    return sorted(
+        {
+            value
+            for node in workflow.values()
+            for value in node["inputs"].values()
+            if isinstance(value, str) and value.startswith(("http://", "https://"))
+        }
+    )
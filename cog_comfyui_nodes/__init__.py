@@ -0,0 +1,22 @@
+"""
+ComfyUI custom nodes used by the cog wrapper.
+This package is linked into ComfyUI/custom_nodes when the server starts.
+"""
+
+from .save_image import CogSaveImage
+from .websocket_save import CogSaveImageWebsocket
+from .weights_readiness import patch_folder_paths
+from .preview_method import register_preview_method_route
+
+patch_folder_paths()
+register_preview_method_route()
+
+NODE_CLASS_MAPPINGS = {
+    "CogSaveImage": CogSaveImage,
+    "CogSaveImageWebsocket": CogSaveImageWebsocket,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "CogSaveImage": "Save Image (cog)",
+    "CogSaveImageWebsocket": "Save Image (cog websocket)",
+}
@@ -0,0 +1,18 @@
+from aiohttp import web
+from server import PromptServer
+from comfy.cli_args import args, LatentPreviewMethod
+
+
+def register_preview_method_route():
+    # ComfyUI reads args.preview_method whenever a sampler starts, so the
+    # wrapper can turn previews on only for the requests that stream them
+    @PromptServer.instance.routes.post("/cog/preview_method")
+    async def set_preview_method(request):
+        data = await request.json()
+        try:
+            args.preview_method = LatentPreviewMethod(data.get("method", "none"))
+        except ValueError:
+            return web.json_response(
+                {"error": f"Unknown preview method {data.get('method')}"}, status=400
+            )
+        return web.json_response({"method": args.preview_method.value})
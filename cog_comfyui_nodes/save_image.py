@@ -0,0 +1,13 @@
+import time
+from nodes import SaveImage
+
+
+class CogSaveImage(SaveImage):
+    """
+    ComfyUI's SaveImage, but never cached. A cached SaveImage reports the
+    files of the last run, which the wrapper has already cleaned up.
+    """
+
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        return time.time()
@@ -0,0 +1,62 @@
+import json
+import time
+import struct
+import numpy as np
+from server import PromptServer
+
+# Must match RAW_IMAGE_EVENT in comfyui.py. ComfyUI's own binary event
+# types are small integers, so this will not clash with previews.
+RAW_IMAGE_EVENT = 0x434F47
+
+
+class CogSaveImageWebsocket:
+    """
+    Sends images to the cog wrapper as raw 8-bit frames over the websocket
+    instead of encoding PNGs to disk. The wrapper encodes them once,
+    straight into the requested output format.
+
+    Message layout after ComfyUI's 4 byte event type:
+    4 byte header length, JSON header, raw HWC uint8 pixels
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "images": ("IMAGE",),
+                "filename_prefix": ("STRING", {"default": "ComfyUI"}),
+            },
+            "hidden": {"unique_id": "UNIQUE_ID"},
+        }
+
+    RETURN_TYPES = ()
+    FUNCTION = "save_images"
+    OUTPUT_NODE = True
+    CATEGORY = "image"
+
+    @classmethod
+    def IS_CHANGED(s, **kwargs):
+        # Never cached, or a repeat of the same inputs would send no frames
+        return time.time()
+
+    def save_images(self, images, filename_prefix="ComfyUI", unique_id=None):
+        server = PromptServer.instance
+        for index, image in enumerate(images):
+            frame = (255.0 * image.cpu().numpy()).clip(0, 255).astype(np.uint8)
+            height, width, channels = frame.shape
+            header = json.dumps(
+                {
+                    "node": unique_id,
+                    "index": index,
+                    "width": width,
+                    "height": height,
+                    "channels": channels,
+                    "filename_prefix": filename_prefix,
+                }
+            ).encode("utf-8")
+            server.send_sync(
+                RAW_IMAGE_EVENT,
+                struct.pack(">I", len(header)) + header + frame.tobytes(),
+                server.client_id,
+            )
+        return {}
@@ -0,0 +1,39 @@
+import os
+import time
+import logging
+import folder_paths
+
+# Must match PENDING_SUFFIX in weights_downloader.py
+PENDING_SUFFIX = ".cog-pending"
+POLL_INTERVAL = 0.1
+
+_get_full_path = folder_paths.get_full_path
+
+
+def wait_for_pending_file(folder_name, filename):
+    # The wrapper writes a marker next to each weight it is still downloading
+    markers = [
+        os.path.join(folder_path, filename) + PENDING_SUFFIX
+        for folder_path in folder_paths.get_folder_paths(folder_name)
+    ]
+    start = time.time()
+    waiting = False
+    while any(os.path.exists(marker) for marker in markers):
+        if not waiting:
+            logging.info(f"Waiting for {filename} to finish downloading")
+            waiting = True
+        time.sleep(POLL_INTERVAL)
+    if waiting:
+        logging.info(f"Waited {time.time() - start:.2f}s for {filename}")
+
+
+def get_full_path(folder_name, filename):
+    if folder_name in folder_paths.folder_names_and_paths:
+        wait_for_pending_file(folder_name, filename)
+    return _get_full_path(folder_name, filename)
+
+
+def patch_folder_paths():
+    # Loader nodes resolve weights through folder_paths.get_full_path, so
+    # they block here until a weight downloading in the background is ready
+    folder_paths.get_full_path = get_full_path
@@ -0,0 +1,63 @@
+from cog import Input
+from cog_model_helpers import seed as seed_helper
+
+MAX_BATCH_SIZE = 64
+
+
+def predict_batch_seeds() -> str:
+    return Input(
+        description="Comma separated list of seeds to run as a batch, e.g. '1, 2, 3'. Use -1 for a random seed. Leave blank to run a single prediction. Batch output filenames start with batch_NNN_, numbering each (prompt, seed) from 000: every seed of the first prompt in order, then the next prompt.",
+        default="",
+    )
+
+
+def predict_batch_prompts() -> str:
+    return Input(
+        description="Prompts to run as a batch, one per line. Every prompt is combined with every batch seed. Leave blank to use the main prompt. See batch_seeds for how outputs are named.",
+        default="",
+    )
+
+
+def parse_seeds(seeds: str) -> list:
+    seeds = [seed.strip() for seed in seeds.replace("\n", ",").split(",")]
+    try:
+        return [seed_helper.generate(int(seed)) for seed in seeds if seed]
+    except ValueError:
+        raise ValueError("Batch seeds must be a comma separated list of integers")
+
+
+def parse_prompts(prompts: str) -> list:
+    return [prompt.strip() for prompt in prompts.splitlines() if prompt.strip()]
+
+
+def variations(prompts: list, seeds: list) -> list:
+    """
+    Returns every (prompt, seed) combination, grouped by prompt
+    """
+    combinations = [(prompt, seed) for prompt in prompts for seed in seeds]
+    if len(combinations) > MAX_BATCH_SIZE:
+        raise ValueError(
+            f"A batch can have at most {MAX_BATCH_SIZE} variations, got {len(combinations)}"
+        )
+    return combinations
+
+
+def check_options(variations: list, output_transport: str, stream_previews: bool):
+    # Batches wait on each prompt in turn and collect files from disk
+    if len(variations) < 2:
+        return
+    if output_transport != "file":
+        raise ValueError("Batches only support the 'file' output_transport")
+    if stream_previews:
+        raise ValueError("Batches do not support stream_previews")
+
+
+def filename_prefix(index: int, prefix: str) -> str:
+    """
+    Prefixes a SaveImage filename_prefix with the variation's index, e.g.
+    batch_002_ComfyUI. Not a subfolder, as ComfyUI restarts its counter in
+    each one and outputs are returned by filename.
+    """
+    directory, name = prefix.rsplit("/", 1) if "/" in prefix else ("", prefix)
+    prefixed = f"batch_{index:03d}_{name}"
+    return f"{directory}/{prefixed}" if directory else prefixed
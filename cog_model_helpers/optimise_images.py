@@ -1,11 +1,46 @@
-from cog import Input
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cog import Input, Path
 from PIL import Image
 
 IMAGE_FILE_EXTENSIONS = [".jpg", ".jpeg", ".png"]
+RAW_IMAGE_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
 FORMAT_CHOICES = ["webp", "jpg", "png"]
 DEFAULT_FORMAT = "webp"
 DEFAULT_QUALITY = 95
 
+# Encoder settings for each effort, trading encode time for file size
+EFFORT_CHOICES = ["fast", "balanced", "smallest"]
+DEFAULT_EFFORT = "balanced"
+EFFORT_SAVE_OPTIONS = {
+    "fast": {
+        "webp": {"method": 0},
+        "jpg": {"optimize": False},
+        "png": {"compress_level": 1},
+    },
+    "balanced": {
+        "webp": {"method": 4},
+        "jpg": {"optimize": True},
+        "png": {"optimize": True},
+    },
+    "smallest": {
+        "webp": {"method": 6},
+        "jpg": {"optimize": True, "progressive": True},
+        "png": {"optimize": True, "compress_level": 9},
+    },
+}
+
+TRANSPORT_CHOICES = ["file", "websocket"]
+DEFAULT_TRANSPORT = "file"
+
+# PIL releases the GIL while encoding, so threads encode in parallel
+MAX_ENCODING_WORKERS = int(os.getenv("MAX_ENCODING_WORKERS", os.cpu_count() or 1))
+encoding_pool = ThreadPoolExecutor(max_workers=MAX_ENCODING_WORKERS)
+encoding_stats = {"files": 0, "seconds": 0.0}
+encoding_stats_lock = threading.Lock()
+
 
 def predict_output_format() -> str:
     return Input(
@@ -24,6 +59,22 @@ def predict_output_quality() -> int:
     )
 
 
+def predict_output_effort() -> str:
+    return Input(
+        description="Encoder effort for the output images. 'fast' encodes quickest, 'smallest' makes the smallest files.",
+        choices=EFFORT_CHOICES,
+        default=DEFAULT_EFFORT,
+    )
+
+
+def predict_output_transport() -> str:
+    return Input(
+        description="How output images reach the model. 'websocket' sends raw frames from ComfyUI and encodes them once, skipping the PNG written to disk.",
+        choices=TRANSPORT_CHOICES,
+        default=DEFAULT_TRANSPORT,
+    )
+
+
 def should_optimise_images(output_format: str, output_quality: int):
     return output_quality < 100 or output_format in [
         "webp",
@@ -31,24 +82,91 @@ def should_optimise_images(output_format: str, output_quality: int):
     ]
 
 
+def already_optimised(file, output_format: str, output_quality: int):
+    # Lossless or full quality outputs in the requested format are kept as is
+    file_format = file.suffix.lower().lstrip(".").replace("jpeg", "jpg")
+    return file_format == output_format and (
+        output_format == "png" or output_quality == 100
+    )
+
+
+def reset_encoding_stats():
+    encoding_stats.update({"files": 0, "seconds": 0.0})
+
+
+def optimise_image_file(
+    file, output_format: str, output_quality: int, effort: str = DEFAULT_EFFORT
+):
+    if not file.is_file() or file.suffix.lower() not in IMAGE_FILE_EXTENSIONS:
+        return file
+    if already_optimised(file, output_format, output_quality):
+        return file
+
+    start = time.time()
+    optimised_file_path = file.with_suffix(f".{output_format}")
+    save_image(
+        Image.open(file), optimised_file_path, output_format, output_quality, effort
+    )
+    record_encoding_time(start)
+    return optimised_file_path
+
+
+def save_raw_image(
+    raw_image: dict,
+    output_path: str,
+    output_format: str,
+    output_quality: int,
+    effort: str = DEFAULT_EFFORT,
+):
+    # Encodes a raw frame sent by CogSaveImageWebsocket straight into the
+    # requested format, skipping ComfyUI's PNG encode, disk write and decode
+    start = time.time()
+    image = Image.frombytes(
+        RAW_IMAGE_MODES[raw_image["channels"]],
+        (raw_image["width"], raw_image["height"]),
+        raw_image["pixels"],
+    )
+    path = Path(f"{output_path}.{output_format}")
+    os.makedirs(path.parent, exist_ok=True)
+    save_image(image, path, output_format, output_quality, effort)
+    record_encoding_time(start)
+    return path
+
+
+def save_image(image, path, output_format: str, output_quality: int, effort: str):
+    if output_format == "jpg" and image.mode not in ["RGB", "L"]:
+        image = image.convert("RGB")
+    image.save(
+        path,
+        quality=output_quality,
+        **EFFORT_SAVE_OPTIONS[effort][output_format],
+    )
+
+
+def record_encoding_time(start):
+    with encoding_stats_lock:
+        encoding_stats["files"] += 1
+        encoding_stats["seconds"] += time.time() - start
+
+
 def optimise_image_files(
-    output_format: str = DEFAULT_FORMAT, output_quality: int = DEFAULT_QUALITY, files=[]
+    output_format: str = DEFAULT_FORMAT,
+    output_quality: int = DEFAULT_QUALITY,
+    files=[],
+    effort: str = DEFAULT_EFFORT,
 ):
     if should_optimise_images(output_format, output_quality):
-        optimised_files = []
-        for file in files:
-            if file.is_file() and file.suffix in IMAGE_FILE_EXTENSIONS:
-                image = Image.open(file)
-                optimised_file_path = file.with_suffix(f".{output_format}")
-                image.save(
-                    optimised_file_path,
-                    quality=output_quality,
-                    optimize=True,
-                )
-                optimised_files.append(optimised_file_path)
-            else:
-                optimised_files.append(file)
-
+        start = time.time()
+        optimised_files = list(
+            encoding_pool.map(
+                lambda file: optimise_image_file(
+                    file, output_format, output_quality, effort
+                ),
+                files,
+            )
+        )
+        if len(files) > 0:
+            print(f"Optimised {len(files)} files in {time.time() - start:.2f}s")
         return optimised_files
     else:
         return files
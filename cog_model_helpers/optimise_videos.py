@@ -0,0 +1,157 @@
+import os
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from cog import Input
+
+VIDEO_FILE_EXTENSIONS = [".mp4", ".webm", ".gif"]
+PRESET_CHOICES = ["none", "fast", "balanced", "smallest"]
+DEFAULT_PRESET = "balanced"
+
+# ffmpeg encoder settings for each preset, by output container
+PRESET_FFMPEG_OPTIONS = {
+    ".mp4": {
+        "fast": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23"],
+        "balanced": ["-c:v", "libx264", "-preset", "medium", "-crf", "23"],
+        "smallest": ["-c:v", "libx264", "-preset", "slow", "-crf", "28"],
+    },
+    ".webm": {
+        "fast": ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8"]
+        + ["-crf", "35", "-b:v", "0"],
+        "balanced": ["-c:v", "libvpx-vp9", "-deadline", "good", "-cpu-used", "4"]
+        + ["-crf", "32", "-b:v", "0"],
+        "smallest": ["-c:v", "libvpx-vp9", "-deadline", "good", "-cpu-used", "1"]
+        + ["-crf", "36", "-b:v", "0"],
+    },
+}
+CONTAINER_FFMPEG_OPTIONS = {
+    # moov atom at the start so playback can begin before the download ends
+    ".mp4": ["-pix_fmt", "yuv420p", "-movflags", "+faststart"],
+    ".webm": ["-pix_fmt", "yuv420p"],
+}
+# Audio codecs each container can hold as they are, and the encoder for the rest
+COPYABLE_AUDIO_CODECS = {
+    ".mp4": ["aac", "opus"],
+    ".webm": ["opus", "vorbis"],
+}
+AUDIO_ENCODERS = {".mp4": "aac", ".webm": "libopus"}
+# yuv420p needs even dimensions, GIFs often have odd ones
+EVEN_DIMENSIONS_FILTER = ["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"]
+
+# ffmpeg is multithreaded itself, so only a few transcodes run at once
+MAX_TRANSCODING_WORKERS = int(
+    os.getenv("MAX_TRANSCODING_WORKERS", min(4, os.cpu_count() or 1))
+)
+transcoding_pool = ThreadPoolExecutor(max_workers=MAX_TRANSCODING_WORKERS)
+
+
+def predict_video_preset() -> str:
+    return Input(
+        description="Transcoding preset for video and GIF outputs. GIFs are converted to mp4. 'none' returns videos as ComfyUI saved them.",
+        choices=PRESET_CHOICES,
+        default=DEFAULT_PRESET,
+    )
+
+
+def audio_codec(file):
+    # None when the file has no audio stream or ffprobe cannot read it.
+    # Audio options are ignored for files without audio.
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "a:0"]
+            + ["-show_entries", "stream=codec_name", "-of", "csv=p=0", str(file)],
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+    return result.stdout.strip() or None
+
+
+def audio_options(file, extension):
+    if audio_codec(file) in COPYABLE_AUDIO_CODECS[extension]:
+        return ["-c:a", "copy"]
+    return ["-c:a", AUDIO_ENCODERS[extension]]
+
+
+def remux_for_streaming(file):
+    # Moves the moov atom to the start without re-encoding
+    remuxed_file_path = file.with_name(f"{file.stem}_remuxed{file.suffix}")
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-i", str(file)]
+    command += ["-map", "0", "-c", "copy", "-movflags", "+faststart", str(remuxed_file_path)]
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Failed to remux {file.name} for streaming: {e.stderr.strip()}")
+        if remuxed_file_path.exists():
+            os.remove(remuxed_file_path)
+        return
+    os.replace(remuxed_file_path, file)
+
+
+def optimise_video_file(file, preset: str = DEFAULT_PRESET):
+    if not file.is_file() or file.suffix.lower() not in VIDEO_FILE_EXTENSIONS:
+        return file
+
+    extension = ".mp4" if file.suffix.lower() == ".gif" else file.suffix.lower()
+    optimised_file_path = file.with_name(f"{file.stem}_optimised{extension}")
+    command = (
+        ["ffmpeg", "-y", "-loglevel", "error", "-i", str(file)]
+        + EVEN_DIMENSIONS_FILTER
+        + PRESET_FFMPEG_OPTIONS[extension][preset]
+        + CONTAINER_FFMPEG_OPTIONS[extension]
+        + audio_options(file, extension)
+        + [str(optimised_file_path)]
+    )
+
+    start = time.time()
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Failed to transcode {file.name}: {e.stderr.strip()}")
+        return file
+
+    original_size = os.path.getsize(file)
+    optimised_size = os.path.getsize(optimised_file_path)
+    elapsed_time = time.time() - start
+
+    # A GIF always becomes an mp4, otherwise keep whichever file is smaller
+    if optimised_size >= original_size and file.suffix.lower() != ".gif":
+        os.remove(optimised_file_path)
+        # The original may not be streamable, so still give it faststart
+        if extension == ".mp4":
+            remux_for_streaming(file)
+        print(f"{file.name} is already optimised ({time.time() - start:.2f}s)")
+        return file
+
+    print(
+        f"✅ {file.name} transcoded to {optimised_file_path.name} in {elapsed_time:.2f}s, "
+        f"{original_size / (1024 * 1024):.2f}MB -> {optimised_size / (1024 * 1024):.2f}MB"
+    )
+    return optimised_file_path
+
+
+def optimise_video_files(preset: str = DEFAULT_PRESET, files=[]):
+    if preset == "none":
+        return files
+
+    start = time.time()
+    optimised_files = list(
+        transcoding_pool.map(lambda file: optimise_video_file(file, preset), files)
+    )
+
+    transcoded = [
+        (file, optimised)
+        for file, optimised in zip(files, optimised_files)
+        if file != optimised
+    ]
+    if transcoded:
+        saved_bytes = sum(
+            os.path.getsize(file) - os.path.getsize(optimised)
+            for file, optimised in transcoded
+        )
+        print(
+            f"Transcoded {len(transcoded)} videos in {time.time() - start:.2f}s, saved {saved_bytes / (1024 * 1024):.2f}MB"
+        )
+    return optimised_files
@@ -0,0 +1,31 @@
+import os
+from cog import Input, Path
+
+PREVIEW_DIR = "/tmp/previews"
+
+
+def predict_stream_previews() -> bool:
+    return Input(
+        description="Stream intermediate previews while the workflow runs. Preview filenames include the percent complete.",
+        default=False,
+    )
+
+
+def predict_preview_interval() -> float:
+    return Input(
+        description="Minimum number of seconds between streamed previews",
+        default=1.0,
+        ge=0,
+        le=60,
+    )
+
+
+def save_preview(preview: dict, index: int, percent: float) -> Path:
+    os.makedirs(PREVIEW_DIR, exist_ok=True)
+    extension = "jpg" if preview["format"] == "jpeg" else preview["format"]
+    path = os.path.join(
+        PREVIEW_DIR, f"preview_{index:04d}_{int(percent):03d}pct.{extension}"
+    )
+    with open(path, "wb") as f:
+        f.write(preview["image"])
+    return Path(path)
@@ -9,36 +9,156 @@ import uuid
 import websocket
 import random
 import requests
-import shutil
+import struct
 import custom_node_helpers as helpers
 from cog import Path
 from node import Node
 from weights_downloader import WeightsDownloader
+from execution_profiler import ExecutionProfiler
+from directory_cleaner import DirectoryCleaner
+from server_memory import ServerMemoryMonitor, process_tree_rss, process_tree_stats
+from resource_sampler import ResourceSampler
+from startup_profiler import startup_profile
+import workflow_optimiser
+import custom_node_selector
+import tracing
+import metrics
+from workflow_validator import WorkflowValidator
+from workflow_template import with_inputs
 from urllib.error import URLError
 
+# ComfyUI BinaryEventTypes.PREVIEW_IMAGE and its image type header values
+PREVIEW_IMAGE_EVENT = 1
+PREVIEW_IMAGE_FORMATS = {1: "jpeg", 2: "png"}
+
+# Raw frames sent by CogSaveImageWebsocket in cog_comfyui_nodes
+RAW_IMAGE_EVENT = 0x434F47
+WRAPPER_NODES_PATH = "cog_comfyui_nodes"
+
+# Ask ComfyUI to free memory every N predictions, 0 to disable. This also
+# resets its execution cache, so the next prediction reloads its models.
+FREE_MEMORY_EVERY = int(os.getenv("COMFYUI_FREE_MEMORY_EVERY", "100"))
+UNLOAD_MODELS_ON_FREE = os.getenv("COMFYUI_UNLOAD_MODELS_ON_FREE", "false") == "true"
+
+# Drop preview-only and dead branches before queueing a workflow
+PRUNE_WORKFLOWS = os.getenv("COMFYUI_PRUNE_WORKFLOWS", "false") == "true"
+# Queue workflows while their weights are still downloading. Loader nodes
+# wait for the weights they need, so earlier nodes run during the download.
+PIPELINE_WEIGHTS = os.getenv("COMFYUI_PIPELINE_WEIGHTS", "false") == "true"
+# Merge nodes that would compute the same result, e.g. duplicated loaders.
+# ComfyUI's cache already runs most duplicates once, so the saving is small.
+MERGE_DUPLICATE_NODES = os.getenv("COMFYUI_MERGE_DUPLICATE_NODES", "false") == "true"
+
+# Preview method for requests that stream previews. Previews cost a latent
+# decode and a websocket frame per sampler step, so other requests run with
+# them off. latent2rgb is the cheapest; use "auto" for TAESD previews if installed.
+PREVIEW_METHOD = os.getenv("COMFYUI_PREVIEW_METHOD", "latent2rgb")
+# Seconds between progress log lines
+PROGRESS_LOG_INTERVAL = 2
+
 
 class ComfyUI:
     def __init__(self, server_address):
         self.weights_downloader = WeightsDownloader()
+        self.profiler = ExecutionProfiler()
+        self.directory_cleaner = DirectoryCleaner()
+        self.server_memory = ServerMemoryMonitor()
+        self.resource_sampler = ResourceSampler()
+        self.server_process = None
+        self.validator = None
+        self.disabled_custom_nodes = []
+        self.prediction_count = 0
         self.server_address = server_address
+        self.server_stats = (0, None)
+        self.preview_method = "none"
+        metrics.start()
 
-    def start_server(self, output_directory, input_directory):
+    @tracing.traced("start server")
+    def start_server(self, output_directory, input_directory, workflows=None):
         self.input_directory = input_directory
         self.output_directory = output_directory
-        self.apply_helper_methods("prepare", weights_downloader=self.weights_downloader)
+        with tracing.span("prepare helpers"):
+            self.apply_helper_methods(
+                "prepare", weights_downloader=self.weights_downloader
+            )
+        self.install_wrapper_nodes()
+        with tracing.span("select custom nodes"):
+            self.disabled_custom_nodes = custom_node_selector.select_custom_nodes(
+                workflows
+            )
 
         start_time = time.time()
         server_thread = threading.Thread(
             target=self.run_server, args=(output_directory, input_directory)
         )
         server_thread.start()
-        while not self.is_server_running():
-            if time.time() - start_time > 60:
-                raise TimeoutError("Server did not start within 60 seconds")
-            time.sleep(0.5)
+        with tracing.span("boot server"):
+            while not self.is_server_running():
+                if time.time() - start_time > 60:
+                    raise TimeoutError("Server did not start within 60 seconds")
+                time.sleep(0.5)
 
         elapsed_time = time.time() - start_time
         print(f"Server started in {elapsed_time:.2f} seconds")
+        if self.server_process:
+            custom_node_selector.report_boot(
+                elapsed_time,
+                process_tree_rss(self.server_process.pid),
+                self.disabled_custom_nodes,
+            )
+        with tracing.span("load validator"):
+            self.load_validator()
+        self.register_metrics()
+        if self.server_process:
+            self.resource_sampler.start(self.server_process.pid, self.profiler)
+
+    def load_validator(self):
+        try:
+            self.validator = WorkflowValidator.load(self.server_address)
+            if self.disabled_custom_nodes:
+                self.validator.object_info = custom_node_selector.without_packages(
+                    self.validator.object_info, self.disabled_custom_nodes
+                )
+        except (URLError, ValueError) as e:
+            print(f"Workflows will not be validated, failed to load node schema: {e}")
+
+    def register_metrics(self):
+        if not metrics.ENABLED:
+            return
+        metrics.QUEUE_DEPTH.set_function(self.get_queue_depth)
+        metrics.SERVER_PROCESSES.set_function(lambda: self.get_server_stats()["processes"])
+        metrics.SERVER_RSS_BYTES.set_function(lambda: self.get_server_stats()["rss"])
+        metrics.SERVER_CPU_SECONDS.labels().set_function(
+            lambda: self.get_server_stats()["cpu_seconds"]
+        )
+        metrics.SERVER_THREADS.set_function(lambda: self.get_server_stats()["threads"])
+        metrics.SERVER_OPEN_FILES.set_function(lambda: self.get_server_stats()["open_files"])
+
+    def get_server_stats(self):
+        # Cached briefly, as every process gauge reads it on each export
+        read_at, stats = self.server_stats
+        if stats is None or time.time() - read_at > 1:
+            stats = process_tree_stats(
+                self.server_process.pid if self.server_process else None
+            )
+            self.server_stats = (time.time(), stats)
+        return stats
+
+    def get_queue(self):
+        with urllib.request.urlopen(
+            f"http://{self.server_address}/queue", timeout=2
+        ) as response:
+            return json.loads(response.read())
+
+    def get_queue_depth(self):
+        queue = self.get_queue()
+        return len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+
+    def install_wrapper_nodes(self):
+        # Link our own custom nodes into ComfyUI so they load with the others
+        link_path = os.path.join("ComfyUI", "custom_nodes", WRAPPER_NODES_PATH)
+        if not os.path.exists(link_path):
+            os.symlink(os.path.abspath(WRAPPER_NODES_PATH), link_path)
 
     def run_server(self, output_directory, input_directory):
         command = f"python ./ComfyUI/main.py --output-directory {output_directory} --input-directory {input_directory} --disable-metadata"
@@ -56,15 +176,18 @@ class ComfyUI:
             stderr=subprocess.PIPE,
             universal_newlines=True,
         )
+        self.server_process = server_process
 
         def print_stdout():
             for stdout_line in iter(server_process.stdout.readline, ""):
+                startup_profile.parse_comfyui_log_line(stdout_line, "stdout")
                 print(f"[ComfyUI] {stdout_line.strip()}")
 
         stdout_thread = threading.Thread(target=print_stdout)
         stdout_thread.start()
 
         for stderr_line in iter(server_process.stderr.readline, ""):
+            startup_profile.parse_comfyui_log_line(stderr_line, "stderr")
             print(f"[ComfyUI] {stderr_line.strip()}")
 
     def is_server_running(self):
@@ -85,7 +208,8 @@ class ComfyUI:
             if callable(method):
                 method(*args, **kwargs)
 
-    def handle_weights(self, workflow, weights_to_download=None):
+    @tracing.traced("handle weights")
+    def handle_weights(self, workflow, weights_to_download=None, pipelined=False):
         if weights_to_download is None:
             weights_to_download = []
 
@@ -94,8 +218,12 @@ class ComfyUI:
         embedding_to_fullname = {emb.split(".")[0]: emb for emb in embeddings}
         weights_filetypes = self.weights_downloader.supported_filetypes
 
-        for node in workflow.values():
-            self.apply_helper_methods("add_weights", weights_to_download, Node(node))
+        for node_id, node in workflow.items():
+            # Helpers may rename inputs, and nodes can be shared with the template
+            copy = with_inputs(node)
+            self.apply_helper_methods("add_weights", weights_to_download, Node(copy))
+            if copy["inputs"] != node["inputs"]:
+                workflow[node_id] = node = copy
 
             for input in node["inputs"].values():
                 if isinstance(input, str):
@@ -111,7 +239,10 @@ class ComfyUI:
         weights_to_download = list(set(weights_to_download))
 
         for weight in weights_to_download:
-            self.weights_downloader.download_weights(weight)
+            if pipelined:
+                self.weights_downloader.download_weights_in_background(weight)
+            else:
+                self.weights_downloader.download_weights(weight)
 
         print("====================================")
 
@@ -125,10 +256,11 @@ class ComfyUI:
         for node in workflow.values():
             self.apply_helper_methods("check_for_unsupported_nodes", Node(node))
 
+    @tracing.traced("handle inputs")
     def handle_inputs(self, workflow):
         print("Checking inputs")
         seen_inputs = set()
-        for node in workflow.values():
+        for node_id, node in workflow.items():
             if "inputs" in node:
                 for input_key, input_value in node["inputs"].items():
                     if isinstance(input_value, str) and input_value not in seen_inputs:
@@ -137,19 +269,30 @@ class ComfyUI:
                             filename = os.path.join(
                                 self.input_directory, os.path.basename(input_value)
                             )
-                            if not os.path.exists(filename):
+                            if os.path.exists(filename):
+                                metrics.INPUT_CACHE.labels("hit").inc()
+                            else:
                                 print(f"Downloading {input_value} to {filename}")
-                                try:
-                                    response = requests.get(input_value)
-                                    response.raise_for_status()
-                                    with open(filename, "wb") as file:
-                                        file.write(response.content)
-                                    print(f"✅ {filename}")
-                                except requests.exceptions.RequestException as e:
-                                    print(f"❌ Error downloading {input_value}: {e}")
+                                metrics.INPUT_CACHE.labels("miss").inc()
+                                with tracing.span("fetch input", url=input_value) as span:
+                                    try:
+                                        response = requests.get(input_value)
+                                        response.raise_for_status()
+                                        with open(filename, "wb") as file:
+                                            file.write(response.content)
+                                        span.set(bytes=len(response.content))
+                                        metrics.DOWNLOADED_BYTES.labels("input").inc(
+                                            len(response.content)
+                                        )
+                                        print(f"✅ {filename}")
+                                    except requests.exceptions.RequestException as e:
+                                        span.set(error=str(e))
+                                        print(f"❌ Error downloading {input_value}: {e}")
 
                             # The same URL may be included in a workflow more than once
-                            node["inputs"][input_key] = filename
+                            workflow[node_id] = with_inputs(
+                                workflow[node_id], **{input_key: filename}
+                            )
 
                         elif self.is_image_or_video_value(input_value):
                             filename = os.path.join(
@@ -162,7 +305,12 @@ class ComfyUI:
 
         print("====================================")
 
+    @tracing.traced("connect")
     def connect(self):
+        # A new connection per prediction drops messages left over from
+        # a prompt that was cancelled
+        if getattr(self, "ws", None):
+            self.ws.close()
         self.client_id = str(uuid.uuid4())
         self.ws = websocket.WebSocket()
         self.ws.connect(f"ws://{self.server_address}/ws?clientId={self.client_id}")
@@ -178,11 +326,37 @@ class ComfyUI:
             if response.status != 200:
                 print(f"Failed: {endpoint}, status code: {response.status}")
 
+    def set_preview_method(self, method):
+        # Set through a route added by cog_comfyui_nodes
+        if method == self.preview_method:
+            return
+        try:
+            self.post_request("/cog/preview_method", {"method": method})
+            self.preview_method = method
+        except URLError as e:
+            print(f"Failed to set preview method to {method}: {e}")
+
     # https://github.com/comfyanonymous/ComfyUI/blob/master/server.py
     def clear_queue(self):
         self.post_request("/queue", {"clear": True})
         self.post_request("/interrupt")
 
+    def cancel_prompts(self, prompt_ids):
+        # Removes the prompts still queued, then interrupts the one running if
+        # it is ours. /interrupt stops whatever ComfyUI is executing, so it is
+        # only sent once, and never for a prompt that was still queued.
+        print(f"Cancelling prompts {', '.join(prompt_ids)}")
+        try:
+            self.post_request("/queue", {"delete": list(prompt_ids)})
+            # Entries are [number, prompt_id, prompt, extra_data, outputs]
+            running = {item[1] for item in self.get_queue().get("queue_running", [])}
+            if running & set(prompt_ids):
+                self.post_request("/interrupt")
+        except OSError as e:
+            # Also timeouts and resets, which must not hide the error that got us here
+            print(f"Failed to cancel prompts {', '.join(prompt_ids)}: {e}")
+
+    @tracing.traced("queue prompt")
     def queue_prompt(self, prompt):
         try:
             # Prompt is the loaded workflow (prompt is the label comfyUI uses)
@@ -193,6 +367,7 @@ class ComfyUI:
             )
 
             output = json.loads(urllib.request.urlopen(req).read())
+            self.last_queued_at = time.time()
             return output["prompt_id"]
         except urllib.error.HTTPError as e:
             print(f"ComfyUI error: {e.code} {e.reason}")
@@ -222,42 +397,207 @@ class ComfyUI:
                 "The weights for this workflow have been corrupted. They have been deleted and will be re-downloaded on the next run. Please try again."
             )
 
-    def wait_for_prompt_completion(self, workflow, prompt_id):
-        while True:
-            out = self.ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
+    def wait_for_prompt_completion(
+        self, workflow, prompt_id, deadline=None, queued_prompt_ids=()
+    ):
+        for _ in self.stream_prompt_events(
+            workflow, prompt_id, deadline=deadline, queued_prompt_ids=queued_prompt_ids
+        ):
+            pass
+
+    def decode_binary_message(self, out):
+        # Binary messages are a 4 byte event type followed by the payload
+        # https://github.com/comfyanonymous/ComfyUI/blob/master/server.py
+        if len(out) < 8:
+            return None
+        event_type, value = struct.unpack(">II", out[:8])
+        if event_type == PREVIEW_IMAGE_EVENT:
+            return {
+                "type": "preview",
+                "format": PREVIEW_IMAGE_FORMATS.get(value, "jpeg"),
+                "image": out[8:],
+            }
+        if event_type == RAW_IMAGE_EVENT:
+            # value is the length of the JSON header sent by CogSaveImageWebsocket
+            header = json.loads(out[8 : 8 + value])
+            return {"type": "raw_image", **header, "pixels": out[8 + value :]}
+        return None
+
+    def stream_prompt_events(
+        self,
+        workflow,
+        prompt_id,
+        preview_interval=None,
+        deadline=None,
+        queued_prompt_ids=(),
+    ):
+        """
+        Waits for a prompt to finish, yielding progress and preview events.
+        Previews are only yielded when preview_interval is set, and at most
+        once every preview_interval seconds. If the prompt is still running
+        at the deadline (a time.time() value) it is cancelled, along with
+        queued_prompt_ids, the prompts queued behind it.
+        """
+        self.profiler.start(workflow, prompt_id)
+        start_time = time.time()
+        finished_nodes = set()
+        last_preview_time = 0
+        last_progress_log_time = 0
+        node_progress = 0
+
+        # Anything that stops us before the prompt completes (an error, the
+        # deadline, or cog cancelling the prediction) also stops the prompt
+        completed = False
+        self.ws.settimeout(None)
+        try:
+            while True:
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._raise_deadline_exceeded(workflow)
+                    self.ws.settimeout(remaining)
+                try:
+                    out = self.ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    continue
 
-                if message["type"] == "execution_error":
-                    error_data = message["data"]
+                if isinstance(out, str):
+                    message = json.loads(out)
+                    self.profiler.handle_message(message)
 
-                    if (
-                        "exception_type" in error_data
-                        and error_data["exception_type"]
-                        == "safetensors_rust.SafetensorError"
-                    ):
-                        self._delete_corrupted_weights(error_data)
+                    if message["type"] == "execution_error":
+                        error_data = message["data"]
 
-                    error_message = json.dumps(message, indent=2)
-                    raise Exception(
-                        f"There was an error executing your workflow:\n\n{error_message}"
-                    )
+                        if (
+                            "exception_type" in error_data
+                            and error_data["exception_type"]
+                            == "safetensors_rust.SafetensorError"
+                        ):
+                            self._delete_corrupted_weights(error_data)
 
-                if message["type"] == "executing":
-                    data = message["data"]
-                    if data["node"] is None and data["prompt_id"] == prompt_id:
-                        break
-                    elif data["prompt_id"] == prompt_id:
-                        node = workflow.get(data["node"], {})
-                        meta = node.get("_meta", {})
-                        class_type = node.get("class_type", "Unknown")
-                        print(
-                            f"Executing node {data['node']}, title: {meta.get('title', 'Unknown')}, class type: {class_type}"
+                        error_message = json.dumps(message, indent=2)
+                        raise Exception(
+                            f"There was an error executing your workflow:\n\n{error_message}"
                         )
-            else:
-                continue
 
-    def load_workflow(self, workflow):
+                    data = message.get("data", {})
+                    if data.get("prompt_id") != prompt_id:
+                        continue
+
+                    if message["type"] == "executing":
+                        if data["node"] is None:
+                            self.record_node_timings(self.profiler.finish())
+                            completed = True
+                            yield {
+                                "type": "progress",
+                                "node": None,
+                                "percent": 100.0,
+                            }
+                            break
+                        else:
+                            finished_nodes.update(self.profiler.nodes)
+                            finished_nodes.discard(data["node"])
+                            node_progress = 0
+                            node = workflow.get(data["node"], {})
+                            meta = node.get("_meta", {})
+                            class_type = node.get("class_type", "Unknown")
+                            print(
+                                f"Executing node {data['node']}, title: {meta.get('title', 'Unknown')}, class type: {class_type}"
+                            )
+
+                    if message["type"] == "progress":
+                        node_progress = data["value"] / max(data["max"], 1)
+
+                    if message["type"] == "executed":
+                        files = self.get_output_files(data.get("output") or {})
+                        if files:
+                            yield {
+                                "type": "output",
+                                "node": data["node"],
+                                "files": files,
+                            }
+
+                    if message["type"] in ["executing", "progress"]:
+                        percent = (
+                            100
+                            * (len(finished_nodes) + node_progress)
+                            / max(len(workflow), 1)
+                        )
+                        # Logged for every request, previews or not, but
+                        # throttled as samplers report every step
+                        now = time.time()
+                        if (
+                            message["type"] == "progress"
+                            and now - last_progress_log_time >= PROGRESS_LOG_INTERVAL
+                        ):
+                            last_progress_log_time = now
+                            print(
+                                f"{min(percent, 99.0):.0f}% complete, node {data['node']} step {data['value']}/{data['max']}"
+                            )
+                        yield {
+                            "type": "progress",
+                            "node": data["node"],
+                            "percent": min(percent, 99.0),
+                        }
+                else:
+                    event = self.decode_binary_message(out)
+                    if event is None:
+                        continue
+                    if event["type"] == "preview":
+                        now = time.time()
+                        if (
+                            preview_interval is None
+                            or now - last_preview_time < preview_interval
+                        ):
+                            continue
+                        last_preview_time = now
+                    yield event
+        finally:
+            tracing.record(
+                "wait for prompt", start_time, prompt_id=prompt_id, completed=completed
+            )
+            if not completed:
+                self.cancel_prompts([prompt_id, *queued_prompt_ids])
+
+    def record_node_timings(self, profile):
+        # Adds the nodes ComfyUI ran to the trace and metrics, timed from the websocket
+        for entry in profile["nodes"]:
+            if metrics.ENABLED:
+                if entry["cached"]:
+                    metrics.CACHED_NODES.labels(entry["class_type"]).inc()
+                else:
+                    metrics.NODE_SECONDS.labels(entry["class_type"]).observe(
+                        entry["wall_time"]
+                    )
+            if not entry["cached"] and entry["start"] is not None:
+                tracing.record(
+                    f"{entry['class_type']} ({entry['node_id']})",
+                    entry["start"],
+                    entry["end"],
+                    node_id=entry["node_id"],
+                    class_type=entry["class_type"],
+                )
+
+    def _raise_deadline_exceeded(self, workflow):
+        node_id = self.profiler.current_node
+        if node_id is None:
+            raise TimeoutError(
+                "Workflow did not finish before its deadline. It had not started running."
+            )
+        node = workflow.get(node_id, {})
+        raise TimeoutError(
+            f"Workflow did not finish before its deadline. Node {node_id} was running, "
+            f"title: {node.get('_meta', {}).get('title', 'Unknown')}, class type: {node.get('class_type', 'Unknown')}"
+        )
+
+    @tracing.traced("load workflow")
+    def load_workflow(
+        self,
+        workflow,
+        prune=PRUNE_WORKFLOWS,
+        merge_duplicates=MERGE_DUPLICATE_NODES,
+        pipeline_weights=PIPELINE_WEIGHTS,
+    ):
         if not isinstance(workflow, dict):
             wf = json.loads(workflow)
         else:
@@ -270,10 +610,48 @@ class ComfyUI:
                 "You need to use the API JSON version of a ComfyUI workflow. To do this go to your ComfyUI settings and turn on 'Enable Dev mode Options'. Then you can save your ComfyUI workflow via the 'Save (API Format)' button."
             )
 
+        if prune:
+            with tracing.span("prune workflow") as span:
+                wf, removed = workflow_optimiser.prune_unreachable_nodes(
+                    wf,
+                    output_node_classes=(
+                        self.validator.output_node_classes() if self.validator else None
+                    ),
+                )
+                span.set(removed=removed)
+        if merge_duplicates and not self.validator:
+            print("Not merging duplicate nodes without the node schema")
+        elif merge_duplicates:
+            with tracing.span("merge duplicate nodes") as span:
+                wf, merged = workflow_optimiser.merge_duplicate_nodes(
+                    wf, self.validator.node_id_dependent_classes()
+                )
+                span.set(merged=merged)
+        if self.validator:
+            with tracing.span("validate workflow"):
+                self.validator.raise_if_invalid(wf)
+
         self.handle_known_unsupported_nodes(wf)
         self.handle_inputs(wf)
-        self.handle_weights(wf)
-        return wf
+        self.handle_weights(wf, pipelined=pipeline_weights)
+        return self.use_uncached_outputs(wf)
+
+    def use_uncached_outputs(self, workflow):
+        # ComfyUI caches SaveImage like any other node, so a repeat of the same
+        # inputs would report the files of the last run, already cleaned up
+        for node_id, node in workflow.items():
+            if node.get("class_type") == "SaveImage":
+                workflow[node_id] = with_inputs(node, class_type="CogSaveImage")
+        return workflow
+
+    def use_websocket_outputs(self, workflow):
+        # Swap SaveImage nodes for CogSaveImageWebsocket, which sends raw frames
+        # over the websocket instead of writing PNGs to the output directory
+        for node_id, node in workflow.items():
+            if node.get("class_type") in ("SaveImage", "CogSaveImage"):
+                print(f"Sending output of node {node_id} over the websocket")
+                workflow[node_id] = with_inputs(node, class_type="CogSaveImageWebsocket")
+        return workflow
 
     def reset_execution_cache(self):
         print("Resetting execution cache")
@@ -294,20 +672,132 @@ class ComfyUI:
             for seed_key in seed_keys:
                 self.randomise_input_seed(seed_key, inputs)
 
-    def run_workflow(self, workflow):
+    def finish_background_downloads(self):
+        downloads = self.weights_downloader.wait_for_background_downloads()
+        if downloads:
+            last_finished = max(end for _, end in downloads.values())
+            overlap = max(0, last_finished - self.last_queued_at)
+            print(
+                f"Workflow started {overlap:.2f}s before its {len(downloads)} weights finished downloading"
+            )
+
+    @tracing.traced("run workflow")
+    def run_workflow(self, workflow, deadline=None):
         print("Running workflow")
+        self.set_preview_method("none")
         prompt_id = self.queue_prompt(workflow)
-        self.wait_for_prompt_completion(workflow, prompt_id)
+        self.wait_for_prompt_completion(workflow, prompt_id, deadline=deadline)
+        self.finish_background_downloads()
         output_json = self.get_history(prompt_id)
         print("outputs: ", output_json)
         print("====================================")
 
+    def run_workflow_stream(self, workflow, preview_interval=None, deadline=None):
+        # Output files are yielded as soon as their node has executed,
+        # while the rest of the graph keeps running on the server
+        print("Running workflow")
+        self.set_preview_method("none" if preview_interval is None else PREVIEW_METHOD)
+        prompt_id = self.queue_prompt(workflow)
+        streamed_files = set()
+        for event in self.stream_prompt_events(
+            workflow, prompt_id, preview_interval=preview_interval, deadline=deadline
+        ):
+            if event["type"] == "output":
+                streamed_files.update(event["files"])
+            yield event
+        self.finish_background_downloads()
+
+        output_json = self.get_history(prompt_id)
+        print("outputs: ", output_json)
+        print("====================================")
+
+        # Catch any output the websocket did not report, e.g. cached output nodes
+        for node_id, node_output in output_json.items():
+            files = [
+                file
+                for file in self.get_output_files(node_output)
+                if file not in streamed_files
+            ]
+            if files:
+                streamed_files.update(files)
+                yield {"type": "output", "node": node_id, "files": files}
+
+    @tracing.traced("run workflows")
+    def run_workflows(self, workflows, deadline=None):
+        # Queue every variant before waiting on any of them. ComfyUI executes
+        # them back to back and its execution cache reuses the nodes whose
+        # inputs did not change (checkpoint loads, preprocessors, VAE encodes)
+        print(f"Running {len(workflows)} workflows")
+        self.set_preview_method("none")
+        prompt_ids = [self.queue_prompt(workflow) for workflow in workflows]
+
+        outputs = []
+        for index, (workflow, prompt_id) in enumerate(zip(workflows, prompt_ids)):
+            start_time = time.time()
+            self.wait_for_prompt_completion(
+                workflow,
+                prompt_id,
+                deadline=deadline,
+                queued_prompt_ids=prompt_ids[index + 1 :],
+            )
+            print(
+                f"Workflow {index + 1}/{len(workflows)} finished in {time.time() - start_time:.2f}s"
+            )
+            outputs.append(self.get_history(prompt_id))
+        self.finish_background_downloads()
+
+        print("outputs: ", outputs)
+        print("====================================")
+        return outputs
+
+    @tracing.traced("get history")
     def get_history(self, prompt_id):
         with urllib.request.urlopen(
             f"http://{self.server_address}/history/{prompt_id}"
         ) as response:
             output = json.loads(response.read())
-            return output[prompt_id]["outputs"]
+
+        # ComfyUI keeps every prompt in memory until it is deleted
+        self.delete_history(prompt_id)
+        return output[prompt_id]["outputs"]
+
+    def delete_history(self, prompt_id):
+        self.post_request("/history", {"delete": [prompt_id]})
+
+    def free_memory(self):
+        print("Asking ComfyUI to free memory")
+        self.post_request(
+            "/free", {"free_memory": True, "unload_models": UNLOAD_MODELS_ON_FREE}
+        )
+
+    def maintain_server(self):
+        self.prediction_count += 1
+        if FREE_MEMORY_EVERY and self.prediction_count % FREE_MEMORY_EVERY == 0:
+            self.free_memory()
+
+        if self.server_process:
+            self.server_memory.record(self.server_process.pid)
+            self.server_memory.print_trend()
+
+    def get_output_files(self, node_output):
+        # Resolves the files listed in an `executed` message or history output,
+        # e.g. {"images": [{"filename": ..., "subfolder": ..., "type": "output"}]}
+        files = []
+        for items in node_output.values():
+            if not isinstance(items, list):
+                continue
+            for item in items:
+                if (
+                    isinstance(item, dict)
+                    and item.get("type") == "output"
+                    and "filename" in item
+                ):
+                    path = os.path.join(
+                        self.output_directory, item.get("subfolder", ""), item["filename"]
+                    )
+                    if os.path.isfile(path):
+                        files.append(Path(path))
+        return files
 
     def get_files(self, directories, prefix="", file_extensions=None):
         files = []
@@ -331,9 +821,10 @@ class ComfyUI:
 
         return sorted(files)
 
+    @tracing.traced("cleanup")
     def cleanup(self, directories):
         self.clear_queue()
+        self.resource_sampler.begin()
+        self.maintain_server()
         for directory in directories:
-            if os.path.exists(directory):
-                shutil.rmtree(directory)
-            os.makedirs(directory)
+            self.directory_cleaner.clean(directory)
@@ -1,11 +1,17 @@
 import os
 import sys
+import time
 import importlib
+from startup_profiler import startup_profile
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 for file in os.listdir(current_dir):
     if file.endswith(".py") and not file.startswith("__"):
         module_name = file[:-3]
+        start_time = time.time()
         module = importlib.import_module(f".{module_name}", package=__name__)
+        startup_profile.record(
+            "helper import", module_name, time.time() - start_time
+        )
         class_name = module_name
         setattr(sys.modules[__name__], class_name, getattr(module, class_name))
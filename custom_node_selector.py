@@ -0,0 +1,183 @@
+import os
+import json
+from workflow_validator import (
+    OBJECT_INFO_CACHE_DIR,
+    WRAPPER_NODES_PATH,
+    object_info_cache_key,
+    object_info_cache_path,
+)
+
+CUSTOM_NODES_PATH = "ComfyUI/custom_nodes"
+# ComfyUI skips custom node packages whose names end in .disabled
+DISABLED_SUFFIX = ".disabled"
+# Packages we disabled, so the next boot can put them back
+DISABLED_STATE_PATH = os.path.join(CUSTOM_NODES_PATH, ".cog_disabled_custom_nodes.json")
+
+# Start ComfyUI with only the custom node packages the workflow uses
+MINIMAL_CUSTOM_NODES = os.getenv("COMFYUI_MINIMAL_CUSTOM_NODES", "false") == "true"
+# Comma separated packages to always load, e.g. ones other packages import
+KEEP_CUSTOM_NODES = [
+    name.strip()
+    for name in os.getenv("COMFYUI_KEEP_CUSTOM_NODES", "").split(",")
+    if name.strip()
+]
+MB = 1024 * 1024
+
+
+def package_of(info):
+    # python_module is "custom_nodes.<package>" for custom nodes, and "nodes"
+    # or "comfy_extras.<module>" for ComfyUI's own
+    module = info.get("python_module", "nodes")
+    if not module.startswith("custom_nodes."):
+        return None
+    return module.split(".")[1]
+
+
+def build_package_index(object_info):
+    return {class_type: package_of(info) for class_type, info in object_info.items()}
+
+
+def load_package_index(cache_dir=OBJECT_INFO_CACHE_DIR):
+    """
+    The class_type to package index, built from the node schema cached by a
+    boot with every package loaded. None until there has been such a boot.
+    """
+    object_info_path = object_info_cache_path(cache_dir)
+    if not os.path.exists(object_info_path):
+        return None
+
+    index_path = os.path.join(cache_dir, f"node_packages_{object_info_cache_key()}.json")
+    if os.path.exists(index_path):
+        with open(index_path, "r") as f:
+            return json.load(f)
+
+    with open(object_info_path, "r") as f:
+        index = build_package_index(json.load(f))
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+    return index
+
+
+def installed_packages():
+    packages = {}
+    for entry in os.listdir(CUSTOM_NODES_PATH):
+        if entry.startswith((".", "__")) or entry.endswith(DISABLED_SUFFIX):
+            continue
+        path = os.path.join(CUSTOM_NODES_PATH, entry)
+        if os.path.isdir(path):
+            packages[entry] = entry
+        elif entry.endswith(".py"):
+            packages[entry[: -len(".py")]] = entry
+    return packages
+
+
+def restore_disabled_packages():
+    if not os.path.exists(DISABLED_STATE_PATH):
+        return
+    with open(DISABLED_STATE_PATH, "r") as f:
+        entries = json.load(f)
+    for entry in entries:
+        path = os.path.join(CUSTOM_NODES_PATH, entry)
+        disabled_path = path + DISABLED_SUFFIX
+        if not os.path.exists(disabled_path):
+            continue
+        if os.path.exists(path):
+            print(f"Not re-enabling {entry}, it has been reinstalled")
+            continue
+        os.rename(disabled_path, path)
+    os.remove(DISABLED_STATE_PATH)
+
+
+def required_packages(workflows, index):
+    """Packages providing the workflows' nodes, or None if one is unknown"""
+    packages = {WRAPPER_NODES_PATH, *KEEP_CUSTOM_NODES}
+    for workflow in workflows:
+        for node in workflow.values():
+            class_type = node.get("class_type")
+            if class_type not in index:
+                print(
+                    f"Loading all custom nodes, '{class_type}' is not in the node package index"
+                )
+                return None
+            if index[class_type]:
+                packages.add(index[class_type])
+    return packages
+
+
+def select_custom_nodes(workflows=None):
+    """
+    Puts back packages disabled by the last boot, then, in minimal mode,
+    disables packages that provide nodes but none the workflows use.
+    Packages without nodes are left alone, as they may patch ComfyUI.
+    Returns the names of the packages disabled.
+    """
+    restore_disabled_packages()
+    if not MINIMAL_CUSTOM_NODES or not workflows:
+        return []
+
+    index = load_package_index()
+    if index is None:
+        print("Loading all custom nodes to build the node package index")
+        return []
+    required = required_packages(workflows, index)
+    if required is None:
+        return []
+
+    providers = {package for package in index.values() if package}
+    installed = installed_packages()
+    disabled = sorted(
+        name for name in installed if name in providers and name not in required
+    )
+    entries = [installed[name] for name in disabled]
+    # Written first, so an interrupted boot still gets restored
+    with open(DISABLED_STATE_PATH, "w") as f:
+        json.dump(entries, f)
+    for entry in entries:
+        path = os.path.join(CUSTOM_NODES_PATH, entry)
+        os.rename(path, path + DISABLED_SUFFIX)
+
+    print(
+        f"Disabled {len(disabled)} of {len(installed)} custom node packages the workflow does not use"
+    )
+    return disabled
+
+
+def without_packages(object_info, packages):
+    # So nodes from disabled packages fail validation rather than in ComfyUI
+    packages = set(packages)
+    return {
+        class_type: info
+        for class_type, info in object_info.items()
+        if package_of(info) not in packages
+    }
+
+
+def report_boot(seconds, rss, disabled, cache_dir=OBJECT_INFO_CACHE_DIR):
+    """
+    Records boot time and memory with every package loaded, and compares
+    minimal boots against it.
+    """
+    stats_path = os.path.join(cache_dir, f"boot_stats_{object_info_cache_key()}.json")
+    stats = {}
+    if os.path.exists(stats_path):
+        with open(stats_path, "r") as f:
+            stats = json.load(f)
+
+    if not disabled:
+        stats["full"] = {"seconds": seconds, "rss": rss}
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(stats_path, "w") as f:
+            json.dump(stats, f)
+        return
+
+    full = stats.get("full")
+    if full is None:
+        print(
+            f"Minimal custom nodes boot took {seconds:.2f}s using {rss / MB:.0f}MB, no full boot to compare with"
+        )
+        return
+    print(
+        f"Minimal custom nodes boot took {seconds:.2f}s using {rss / MB:.0f}MB, "
+        f"saving {full['seconds'] - seconds:.2f}s and {(full['rss'] - rss) / MB:.0f}MB "
+        f"against loading every package"
+    )
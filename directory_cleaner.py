@@ -0,0 +1,68 @@
+import os
+import glob
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+TOMBSTONE_SUFFIX = ".tombstone-"
+MAX_PENDING_TOMBSTONES = int(os.getenv("MAX_PENDING_TOMBSTONES", "8"))
+
+
+class DirectoryCleaner:
+    """
+    Empties directories without making the caller wait for the delete.
+
+    Each directory is renamed to a tombstone next to it and recreated empty
+    straight away. A background thread deletes the tombstones. Cleaning only
+    blocks if more than max_pending tombstones are still waiting to be deleted.
+    """
+
+    def __init__(self, max_pending=MAX_PENDING_TOMBSTONES):
+        self.tombstones = queue.Queue(maxsize=max_pending)
+        self.swept_directories = set()
+        worker = threading.Thread(target=self._delete_tombstones, daemon=True)
+        worker.start()
+
+    def _delete_tombstones(self):
+        while True:
+            tombstone = self.tombstones.get()
+            start = time.time()
+            shutil.rmtree(tombstone, ignore_errors=True)
+            print(f"Deleted {tombstone} in {time.time() - start:.2f}s")
+            self.tombstones.task_done()
+
+    def _queue_tombstone(self, tombstone):
+        if self.tombstones.full():
+            print(f"Waiting for {self.tombstones.qsize()} tombstones to be deleted")
+        self.tombstones.put(tombstone)
+
+    def _sweep(self, directory):
+        # Tombstones left behind by a previous process that exited mid-delete
+        if directory in self.swept_directories:
+            return
+        self.swept_directories.add(directory)
+        for tombstone in glob.glob(f"{glob.escape(directory)}{TOMBSTONE_SUFFIX}*"):
+            self._queue_tombstone(tombstone)
+
+    def clean(self, directory):
+        directory = directory.rstrip("/")
+        self._sweep(directory)
+
+        if os.path.exists(directory):
+            tombstone = f"{directory}{TOMBSTONE_SUFFIX}{uuid.uuid4().hex[:8]}"
+            try:
+                os.rename(directory, tombstone)
+            except OSError:
+                # e.g. a mount point, which can't be renamed
+                shutil.rmtree(directory)
+                tombstone = None
+            os.makedirs(directory)
+            if tombstone:
+                self._queue_tombstone(tombstone)
+        else:
+            os.makedirs(directory)
+
+    def wait(self):
+        self.tombstones.join()
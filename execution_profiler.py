@@ -0,0 +1,154 @@
+import os
+import json
+import time
+
+PROFILE_DIR = os.getenv("COMFYUI_PROFILE_DIR")
+
+
+class ExecutionProfiler:
+    """
+    Builds a per-node profile of a prompt from ComfyUI's websocket messages.
+
+    ComfyUI sends an `executing` message when each node starts, so a node's
+    wall time runs until the next `executing` message for the same prompt.
+    Nodes listed in `execution_cached` were not run at all.
+    """
+
+    def __init__(self, profile_dir=PROFILE_DIR):
+        self.profile_dir = profile_dir
+        self.aggregates = {}
+        self.last_profile = None
+        self.prompt_id = None
+
+    def start(self, workflow, prompt_id):
+        self.workflow = workflow
+        self.prompt_id = prompt_id
+        self.start_time = time.time()
+        self.nodes = {}
+        self.current_node = None
+
+    def _node_entry(self, node_id):
+        if node_id not in self.nodes:
+            node = self.workflow.get(node_id, {})
+            self.nodes[node_id] = {
+                "node_id": node_id,
+                "class_type": node.get("class_type", "Unknown"),
+                "title": node.get("_meta", {}).get("title", "Unknown"),
+                "start": None,
+                "end": None,
+                "wall_time": 0.0,
+                "cached": False,
+                "progress_steps": 0,
+            }
+        return self.nodes[node_id]
+
+    def _close_current_node(self, now):
+        if self.current_node is not None:
+            entry = self.nodes[self.current_node]
+            entry["end"] = now
+            entry["wall_time"] = now - entry["start"]
+            self.current_node = None
+
+    def handle_message(self, message):
+        data = message.get("data", {})
+        if self.prompt_id is None or data.get("prompt_id") != self.prompt_id:
+            return
+
+        now = time.time()
+        message_type = message["type"]
+
+        if message_type == "execution_cached":
+            for node_id in data.get("nodes", []):
+                entry = self._node_entry(node_id)
+                entry["cached"] = True
+                entry["start"] = entry["end"] = now
+        elif message_type == "executing":
+            self._close_current_node(now)
+            if data["node"] is not None:
+                self.current_node = data["node"]
+                self._node_entry(data["node"])["start"] = now
+        elif message_type == "progress" and data.get("node") in self.nodes:
+            self.nodes[data["node"]]["progress_steps"] = data.get("value", 0)
+        elif message_type == "executed" and data.get("node") in self.nodes:
+            self.nodes[data["node"]]["executed_at"] = now
+
+    def finish(self):
+        now = time.time()
+        self._close_current_node(now)
+
+        nodes = sorted(self.nodes.values(), key=lambda entry: entry["start"] or 0)
+        profile = {
+            "prompt_id": self.prompt_id,
+            "start": self.start_time,
+            "total_time": now - self.start_time,
+            "nodes": nodes,
+        }
+        self._update_aggregates(nodes)
+        self.last_profile = profile
+        self.prompt_id = None
+
+        self.print_summary(profile)
+        if self.profile_dir:
+            self.write(profile)
+        return profile
+
+    def _update_aggregates(self, nodes):
+        for entry in nodes:
+            aggregate = self.aggregates.setdefault(
+                entry["class_type"],
+                {"count": 0, "cached": 0, "total_time": 0.0, "max_time": 0.0},
+            )
+            aggregate["count"] += 1
+            if entry["cached"]:
+                aggregate["cached"] += 1
+            else:
+                aggregate["total_time"] += entry["wall_time"]
+                aggregate["max_time"] = max(aggregate["max_time"], entry["wall_time"])
+
+    def print_summary(self, profile):
+        print(f"Prompt {profile['prompt_id']} took {profile['total_time']:.2f}s")
+        executed = [entry for entry in profile["nodes"] if not entry["cached"]]
+        for entry in sorted(executed, key=lambda e: e["wall_time"], reverse=True):
+            print(
+                f"  {entry['wall_time']:.2f}s node {entry['node_id']}, class type: {entry['class_type']}"
+            )
+        cached = len(profile["nodes"]) - len(executed)
+        if cached:
+            print(f"  {cached} nodes cached")
+
+    def chrome_trace(self, profile):
+        events = []
+        for entry in profile["nodes"]:
+            if entry["start"] is None:
+                continue
+            event = {
+                "name": f"{entry['class_type']} ({entry['node_id']})",
+                "cat": "cached" if entry["cached"] else "node",
+                "ts": (entry["start"] - profile["start"]) * 1e6,
+                "pid": 1,
+                "tid": 1,
+                "args": {
+                    "node_id": entry["node_id"],
+                    "title": entry["title"],
+                    "progress_steps": entry["progress_steps"],
+                },
+            }
+            if entry["cached"]:
+                event.update({"ph": "i", "s": "t"})
+            else:
+                event.update({"ph": "X", "dur": entry["wall_time"] * 1e6})
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, profile):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        prompt_id = profile["prompt_id"]
+        files = {
+            f"{prompt_id}.json": profile,
+            f"{prompt_id}.trace.json": self.chrome_trace(profile),
+            "aggregates.json": self.aggregates,
+        }
+        for filename, content in files.items():
+            with open(os.path.join(self.profile_dir, filename), "w") as f:
+                json.dump(content, f, indent=2)
+        print(f"Profile written to {self.profile_dir}")
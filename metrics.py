@@ -0,0 +1,297 @@
+import os
+import math
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tracing
+
+# Serve metrics on this port at /metrics, 0 to disable
+METRICS_PORT = int(os.getenv("COMFYUI_METRICS_PORT", "0"))
+# Or write them to this file after each prediction, e.g. for the node_exporter
+# textfile collector
+METRICS_TEXTFILE = os.getenv("COMFYUI_METRICS_TEXTFILE")
+ENABLED = bool(METRICS_PORT or METRICS_TEXTFILE)
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600,
+)
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REGISTRY = []
+_lock = threading.Lock()
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    # OpenMetrics spells non-finite values NaN, +Inf and -Inf
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *labelvalues, **labelkwargs):
+        if labelkwargs:
+            labelvalues = tuple(labelkwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in labelvalues)
+        with _lock:
+            if key not in self.children:
+                self.children[key] = self._new_child()
+            return self.children[key]
+
+    def render(self, openmetrics):
+        family = self.name
+        if self.type == "counter" and not openmetrics:
+            family = f"{self.name}_total"
+        lines = [
+            f"# HELP {family} {self.documentation}",
+            f"# TYPE {family} {self.type}",
+        ]
+        with _lock:
+            children = list(self.children.items())
+        for labelvalues, child in children:
+            lines.extend(self._samples(labelvalues, child))
+        return lines
+
+
+class Value:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def inc(self, amount=1):
+        with _lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        # Read when metrics are exported, e.g. for process gauges
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception as e:
+                print(f"Failed to read metric: {e}")
+                return math.nan
+        return self.value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self, labelvalues, child):
+        labels = format_labels(self.labelnames, labelvalues)
+        return [f"{self.name}_total{labels} {format_value(child.get())}"]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+    def _samples(self, labelvalues, child):
+        labels = format_labels(self.labelnames, labelvalues)
+        return [f"{self.name}{labels} {format_value(child.get())}"]
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with _lock:
+            self.sum += value
+            self.count += 1
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+                    break
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self, labelvalues, child):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            labels = format_labels(
+                self.labelnames, labelvalues, {"le": format_value(bound)}
+            )
+            samples.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.labelnames, labelvalues)
+        samples.append(f"{self.name}_count{labels} {child.count}")
+        samples.append(f"{self.name}_sum{labels} {format_value(child.sum)}")
+        return samples
+
+
+def render(openmetrics=True):
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(openmetrics))
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+PREDICTIONS = Counter(
+    "cog_comfyui_predictions", "Predictions by outcome", ["status"]
+)
+PHASE_SECONDS = Histogram(
+    "cog_comfyui_phase_seconds", "Time spent in each phase of setup and predict", ["phase"]
+)
+WEIGHT_CACHE = Counter(
+    "cog_comfyui_weight_cache", "Weight lookups by whether the file was already on disk", ["result"]
+)
+DOWNLOADED_BYTES = Counter(
+    "cog_comfyui_downloaded_bytes", "Bytes downloaded for weights and inputs", ["kind"]
+)
+INPUT_CACHE = Counter(
+    "cog_comfyui_input_cache", "URL inputs by whether the file was already downloaded", ["result"]
+)
+QUEUE_DEPTH = Gauge(
+    "cog_comfyui_queue_depth", "Prompts running or pending in ComfyUI's queue"
+)
+NODE_SECONDS = Histogram(
+    "cog_comfyui_node_seconds", "Execution time of nodes that ComfyUI ran", ["class_type"]
+)
+CACHED_NODES = Counter(
+    "cog_comfyui_cached_nodes", "Nodes ComfyUI reused from its execution cache", ["class_type"]
+)
+ENCODE_SECONDS = Histogram(
+    "cog_comfyui_encode_seconds", "Time spent encoding output images per prediction"
+)
+ENCODED_FILES = Counter("cog_comfyui_encoded_files", "Output images encoded")
+SERVER_RSS_BYTES = Gauge(
+    "cog_comfyui_server_rss_bytes", "Resident memory of the ComfyUI process tree"
+)
+SERVER_CPU_SECONDS = Counter(
+    "cog_comfyui_server_cpu_seconds", "CPU time used by the ComfyUI process tree"
+)
+SERVER_THREADS = Gauge("cog_comfyui_server_threads", "Threads in the ComfyUI process tree")
+SERVER_OPEN_FILES = Gauge(
+    "cog_comfyui_server_open_files", "Open files in the ComfyUI process tree"
+)
+SERVER_PROCESSES = Gauge(
+    "cog_comfyui_server_processes", "Processes in the ComfyUI process tree, 0 if it is not running"
+)
+
+
+def observe_span(span):
+    # Node spans are recorded per class_type in NODE_SECONDS instead
+    if "node_id" not in span.attributes:
+        PHASE_SECONDS.labels(span.name).observe(span.end - span.start)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = render(openmetrics).encode("utf-8")
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE,
+        )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_started = False
+
+
+def start():
+    global _started
+    if not ENABLED or _started:
+        return
+    _started = True
+    tracing.add_span_listener(observe_span)
+    if METRICS_PORT:
+        server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics on port {METRICS_PORT} at /metrics")
+
+
+def write_textfile():
+    if not METRICS_TEXTFILE:
+        return
+    start_time = time.time()
+    # Written then renamed, so a collector never reads a partial file
+    temp_path = f"{METRICS_TEXTFILE}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(render(openmetrics=False))
+    os.replace(temp_path, METRICS_TEXTFILE)
+    PHASE_SECONDS.labels("write metrics").observe(time.time() - start_time)
+
+
+def prediction_finished(status, encoding_stats=None):
+    if not ENABLED:
+        return
+    PREDICTIONS.labels(status).inc()
+    if encoding_stats and encoding_stats["files"]:
+        ENCODE_SECONDS.observe(encoding_stats["seconds"])
+        ENCODED_FILES.inc(encoding_stats["files"])
+    try:
+        write_textfile()
+    except OSError as e:
+        print(f"Failed to write metrics to {METRICS_TEXTFILE}: {e}")
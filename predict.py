@@ -1,17 +1,41 @@
 import os
+import time
 import mimetypes
 import json
 import shutil
-from typing import List, Optional
-from cog import BasePredictor, Input, Path
+from typing import Iterator, List, Optional
+from cog import BasePredictor, CancelationException, Input, Path
 from comfyui import ComfyUI
+from workflow_template import WorkflowTemplate, with_inputs
+import tracing
+import metrics
+from startup_profiler import startup_profile
 from cog_model_helpers import optimise_images
+from cog_model_helpers import optimise_videos
 from cog_model_helpers import seed as seed_helper
+from cog_model_helpers import batch as batch_helper
+from cog_model_helpers import previews
 
 OUTPUT_DIR = "/tmp/outputs"
 INPUT_DIR = "/tmp/inputs"
 COMFYUI_TEMP_OUTPUT_DIR = "ComfyUI/temp"
-ALL_DIRECTORIES = [OUTPUT_DIR, INPUT_DIR, COMFYUI_TEMP_OUTPUT_DIR]
+ALL_DIRECTORIES = [
+    OUTPUT_DIR,
+    INPUT_DIR,
+    COMFYUI_TEMP_OUTPUT_DIR,
+    previews.PREVIEW_DIR,
+]
+
+# Cancel a prediction's workflow if it runs longer than this, 0 for no limit
+PREDICTION_TIMEOUT = int(os.getenv("PREDICTION_TIMEOUT", "0"))
+
+# Workflow inputs set from the predict inputs, as (node id, input name)
+WORKFLOW_BINDINGS = {
+    "prompt": [("4", "text")],
+    "negative_prompt": [("5", "text")],
+    "image_filename": [("242", "image"), ("155", "image")],
+    "seed": [("81", "seed")],
+}
 
 # Ensure proper MIME type handling
 mimetypes.add_type("image/webp", ".webp")
@@ -19,18 +43,25 @@ mimetypes.add_type("image/webp", ".webp")
 class Predictor(BasePredictor):
     def __init__(self):
         """Initialize ComfyUI server and download required model weights"""
-        self.comfyUI = ComfyUI("127.0.0.1:8188")
-        self.comfyUI.start_server(OUTPUT_DIR, INPUT_DIR)
+        startup_profile.begin()
+        with tracing.trace("setup"):
+            self.comfyUI = ComfyUI("127.0.0.1:8188")
+            workflow = self._load_workflow()
+            # Only needs the custom nodes this workflow uses in minimal mode
+            self.comfyUI.start_server(OUTPUT_DIR, INPUT_DIR, workflows=[workflow])
 
-        # Load workflow to analyze required weights
-        workflow = self._load_workflow()
+            # Parse the workflow once and check its bindings before serving requests
+            self.template = WorkflowTemplate(workflow, WORKFLOW_BINDINGS)
 
-        # Required weights based on the workflow
-        required_weights = [
-            "realvisxlV40_v40Bakedvae.safetensors"
-        ]
+            # Required weights based on the workflow
+            required_weights = [
+                "realvisxlV40_v40Bakedvae.safetensors"
+            ]
         
-        self.comfyUI.handle_weights(workflow, weights_to_download=required_weights)
+            self.comfyUI.handle_weights(
+                self.template.workflow, weights_to_download=required_weights
+            )
+        startup_profile.finish()
 
     def _load_workflow(self) -> dict:
         """Load workflow from JSON file"""
@@ -42,6 +73,7 @@ class Predictor(BasePredictor):
         except json.JSONDecodeError:
             raise RuntimeError("Invalid JSON in workflow_api.json")
 
+    @tracing.traced("stage input")
     def _handle_input_file(self, input_file: Path, prefix: str) -> str:
         """
         Copy input file to input directory with preserved extension
@@ -57,33 +89,43 @@ class Predictor(BasePredictor):
         shutil.copy(input_file, input_path)
         return filename
 
-    def _update_workflow(self, workflow: dict, **kwargs) -> None:
-        """Update workflow nodes based on input parameters"""
-        updates = {
-            "prompt": (["4", "inputs", "text"], kwargs.get("prompt")),
-            "negative_prompt": (["5", "inputs", "text"], kwargs.get("negative_prompt")),
-            "image_filename": (
-                [("242", "inputs", "image"), ("155", "inputs", "image")],
-                kwargs.get("image_filename")
-            ),
-            "image_2": (["155", "inputs", "image"], kwargs.get("image_filename")),
-            "seed": (["81", "inputs", "seed"], kwargs.get("seed"))
-        }
-
-        for key, (paths, value) in updates.items():
-            if value is not None:
-                if isinstance(paths[0], tuple):  # Multiple paths to update
-                    for path in paths:
-                        self._set_nested_value(workflow, path, value)
-                else:  # Single path
-                    self._set_nested_value(workflow, paths, value)
-
-    def _set_nested_value(self, obj: dict, path: List[str], value: any) -> None:
-        """Helper method to set nested dictionary value"""
-        for key in path[:-1]:
-            obj = obj[key]
-        obj[path[-1]] = value
+    @tracing.traced("build batch")
+    def _build_batch(self, variations: List[tuple], **values) -> List[dict]:
+        """
+        Render one copy-on-write variant of the template per (prompt, seed)
+        Each variant is bound before it is loaded, so the optimiser passes
+        (and the weights its prompt needs) see its own inputs
+        Output filenames start with batch_NNN_, the variation's index
+        """
+        workflows = []
+        for index, (prompt, seed) in enumerate(variations):
+            print(f"batch_{index:03d}: seed {seed}, prompt: {prompt}")
+            variant = self.template.render(prompt=prompt, seed=seed, **values)
+            for node_id, node in list(variant.items()):
+                prefix = node.get("inputs", {}).get("filename_prefix")
+                if isinstance(prefix, str):
+                    variant[node_id] = with_inputs(
+                        node, filename_prefix=batch_helper.filename_prefix(index, prefix)
+                    )
+            workflows.append(self.comfyUI.load_workflow(variant))
+        return workflows
+
+    @tracing.traced("encode outputs")
+    def _optimise_output_files(
+        self,
+        files: List[Path],
+        output_format: str,
+        output_quality: int,
+        output_effort: str,
+        video_preset: str,
+    ) -> List[Path]:
+        """Re-encode image outputs and transcode video outputs"""
+        files = optimise_images.optimise_image_files(
+            output_format, output_quality, files, output_effort
+        )
+        return optimise_videos.optimise_video_files(video_preset, files)
 
+    @tracing.traced_generator("predict")
     def predict(
         self,
         prompt: str = Input(
@@ -100,9 +142,17 @@ class Predictor(BasePredictor):
         ),
         output_format: str = optimise_images.predict_output_format(),
         output_quality: int = optimise_images.predict_output_quality(),
+        output_effort: str = optimise_images.predict_output_effort(),
+        output_transport: str = optimise_images.predict_output_transport(),
+        video_preset: str = optimise_videos.predict_video_preset(),
         seed: int = seed_helper.predict_seed(),
-    ) -> List[Path]:
+        batch_seeds: str = batch_helper.predict_batch_seeds(),
+        batch_prompts: str = batch_helper.predict_batch_prompts(),
+        stream_previews: bool = previews.predict_stream_previews(),
+        preview_interval: float = previews.predict_preview_interval(),
+    ) -> Iterator[Path]:
         """Run prediction on the model"""
+        deadline = time.time() + PREDICTION_TIMEOUT if PREDICTION_TIMEOUT else None
         try:
             if image is None:
                 raise ValueError("An input image is required for this workflow")
@@ -120,36 +170,106 @@ class Predictor(BasePredictor):
 
             # Clean up previous runs
             self.comfyUI.cleanup(ALL_DIRECTORIES)
+            optimise_images.reset_encoding_stats()
 
             # Handle input image and seed
             image_filename = self._handle_input_file(image, "image")
             actual_seed = seed_helper.generate(seed)
-
-            # Load and update workflow
-            workflow = self._load_workflow()
-            self._update_workflow(
-                workflow,
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                image_filename=image_filename,
-                seed=actual_seed,
+            variations = batch_helper.variations(
+                batch_helper.parse_prompts(batch_prompts) or [prompt],
+                batch_helper.parse_seeds(batch_seeds) or [actual_seed],
             )
+            batch_helper.check_options(variations, output_transport, stream_previews)
 
             # Execute workflow
             self.comfyUI.connect()
-            wf = self.comfyUI.load_workflow(workflow)
-            self.comfyUI.run_workflow(wf)
+            returned_files = []
+            if len(variations) > 1:
+                self.comfyUI.run_workflows(
+                    self._build_batch(
+                        variations,
+                        negative_prompt=negative_prompt,
+                        image_filename=image_filename,
+                    ),
+                    deadline=deadline,
+                )
+            else:
+                # Bind the inputs to the workflow
+                wf = self.comfyUI.load_workflow(
+                    self.template.render(
+                        prompt=variations[0][0],
+                        negative_prompt=negative_prompt,
+                        image_filename=image_filename,
+                        seed=variations[0][1],
+                    )
+                )
+                if output_transport == "websocket":
+                    wf = self.comfyUI.use_websocket_outputs(wf)
+
+                percent = 0
+                preview_count = 0
+                run_start = time.time()
+                for event in self.comfyUI.run_workflow_stream(
+                    wf, preview_interval if stream_previews else None, deadline
+                ):
+                    if event["type"] == "progress":
+                        percent = event["percent"]
+                    elif event["type"] == "preview":
+                        yield previews.save_preview(event, preview_count, percent)
+                        preview_count += 1
+                    elif event["type"] == "output":
+                        optimised_files = self._optimise_output_files(
+                            event["files"],
+                            output_format,
+                            output_quality,
+                            output_effort,
+                            video_preset,
+                        )
+                        returned_files.extend(event["files"] + optimised_files)
+                        yield from optimised_files
+                    elif event["type"] == "raw_image":
+                        filename = f"{event['filename_prefix']}_{event['node']}_{event['index']:05d}_"
+                        with tracing.span("encode raw image"):
+                            output_file = optimise_images.save_raw_image(
+                                event,
+                                os.path.join(OUTPUT_DIR, filename),
+                                output_format,
+                                output_quality,
+                                output_effort,
+                            )
+                        returned_files.append(output_file)
+                        yield output_file
+                tracing.record("run workflow", run_start)
 
-            # Get and optimize output files
-            output_files = self.comfyUI.get_files(OUTPUT_DIR)
-            if not output_files:
+            # Get and optimize any output files that were not already returned
+            with tracing.span("collect outputs"):
+                output_files = [
+                    file
+                    for file in self.comfyUI.get_files(OUTPUT_DIR)
+                    if file not in returned_files
+                ]
+            if not output_files and not returned_files:
                 raise RuntimeError("No output files generated")
 
-            return optimise_images.optimise_image_files(
+            yield from self._optimise_output_files(
+                output_files,
                 output_format,
                 output_quality,
-                output_files
+                output_effort,
+                video_preset,
             )
 
+            stats = optimise_images.encoding_stats
+            print(f"Encoded {stats['files']} images in {stats['seconds']:.2f}s")
+            metrics.prediction_finished("succeeded", stats)
+
+        except (GeneratorExit, CancelationException):
+            # CancelationException is a BaseException, raised when cog cancels
+            metrics.prediction_finished("cancelled")
+            raise
         except Exception as e:
+            metrics.prediction_finished("failed")
             raise RuntimeError(f"Prediction failed: {str(e)}")
+        finally:
+            self.comfyUI.resource_sampler.finish()
+            self.comfyUI.weights_downloader.discard_finished_downloads()
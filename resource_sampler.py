@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import threading
+from execution_profiler import PROFILE_DIR
+from server_memory import process_tree_stats
+
+# Seconds between samples of the ComfyUI process tree, 0 to disable
+SAMPLE_INTERVAL = float(os.getenv("COMFYUI_RESOURCE_SAMPLE_INTERVAL", "0"))
+MB = 1024 * 1024
+
+
+class ResourceSampler:
+    """
+    Samples CPU, memory, open files, disk I/O and threads of the ComfyUI
+    process tree in the background. Each sample is tagged with the node
+    the execution profiler says is running, so a prediction's resource use
+    can be broken down by class_type.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, profile_dir=PROFILE_DIR):
+        self.interval = interval
+        self.profile_dir = profile_dir
+        self.samples = []
+        self.aggregates = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, pid, profiler):
+        if not self.interval or self.thread is not None:
+            return
+        self.pid = pid
+        self.profiler = profiler
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        print(f"Sampling ComfyUI resource use every {self.interval}s")
+
+    def _run(self):
+        previous = None
+        while True:
+            now = time.time()
+            stats = process_tree_stats(self.pid)
+            if previous is not None and stats["processes"]:
+                self._add_sample(now, stats, previous)
+            previous = (now, stats)
+            time.sleep(self.interval)
+
+    def _running_node(self):
+        node_id = self.profiler.current_node
+        if self.profiler.prompt_id is None or node_id is None:
+            return None, "idle"
+        node = self.profiler.workflow.get(node_id, {})
+        return node_id, node.get("class_type", "Unknown")
+
+    def _add_sample(self, now, stats, previous):
+        previous_time, previous_stats = previous
+        elapsed = max(now - previous_time, 1e-6)
+        node_id, class_type = self._running_node()
+        sample = {
+            "time": now,
+            "node_id": node_id,
+            "class_type": class_type,
+            "cpu_percent": 100
+            * (stats["cpu_seconds"] - previous_stats["cpu_seconds"])
+            / elapsed,
+            "rss": stats["rss"],
+            "threads": stats["threads"],
+            "open_files": stats["open_files"],
+            "read_bytes": max(0, stats["read_bytes"] - previous_stats["read_bytes"]),
+            "write_bytes": max(0, stats["write_bytes"] - previous_stats["write_bytes"]),
+        }
+        with self.lock:
+            self.samples.append(sample)
+
+    def begin(self):
+        with self.lock:
+            self.samples = []
+
+    def finish(self):
+        if self.thread is None:
+            return None
+        with self.lock:
+            samples = self.samples
+            self.samples = []
+        if not samples:
+            return None
+
+        summary = {
+            "start": samples[0]["time"],
+            "end": samples[-1]["time"],
+            **self._summarise(samples),
+            "class_types": {
+                class_type: self._summarise(
+                    [s for s in samples if s["class_type"] == class_type]
+                )
+                for class_type in {s["class_type"] for s in samples}
+            },
+        }
+        self._update_aggregates(summary["class_types"])
+        self.print_summary(summary)
+        if self.profile_dir:
+            self.write(summary, samples)
+        return summary
+
+    def _summarise(self, samples):
+        rss = [s["rss"] for s in samples]
+        return {
+            "samples": len(samples),
+            "mean_cpu_percent": sum(s["cpu_percent"] for s in samples) / len(samples),
+            "max_cpu_percent": max(s["cpu_percent"] for s in samples),
+            "peak_rss_mb": max(rss) / MB,
+            "rss_growth_mb": (rss[-1] - rss[0]) / MB,
+            "read_mb": sum(s["read_bytes"] for s in samples) / MB,
+            "write_mb": sum(s["write_bytes"] for s in samples) / MB,
+            "max_open_files": max(s["open_files"] for s in samples),
+            "max_threads": max(s["threads"] for s in samples),
+        }
+
+    def _update_aggregates(self, class_types):
+        for class_type, summary in class_types.items():
+            aggregate = self.aggregates.setdefault(
+                class_type,
+                {"samples": 0, "cpu_percent_total": 0.0, "peak_rss_mb": 0.0, "read_mb": 0.0, "write_mb": 0.0},
+            )
+            aggregate["samples"] += summary["samples"]
+            aggregate["cpu_percent_total"] += summary["mean_cpu_percent"] * summary["samples"]
+            aggregate["peak_rss_mb"] = max(aggregate["peak_rss_mb"], summary["peak_rss_mb"])
+            aggregate["read_mb"] += summary["read_mb"]
+            aggregate["write_mb"] += summary["write_mb"]
+
+    def print_summary(self, summary):
+        print(
+            f"ComfyUI resources: peak RSS {summary['peak_rss_mb']:.0f}MB, mean CPU {summary['mean_cpu_percent']:.0f}%, "
+            f"read {summary['read_mb']:.1f}MB, wrote {summary['write_mb']:.1f}MB over {summary['samples']} samples"
+        )
+        by_memory = sorted(
+            summary["class_types"].items(), key=lambda item: item[1]["peak_rss_mb"], reverse=True
+        )
+        for class_type, entry in by_memory:
+            print(
+                f"  {class_type}: peak RSS {entry['peak_rss_mb']:.0f}MB ({entry['rss_growth_mb']:+.0f}MB), "
+                f"CPU {entry['mean_cpu_percent']:.0f}%, I/O {entry['read_mb'] + entry['write_mb']:.1f}MB, "
+                f"{entry['samples']} samples"
+            )
+
+    def write(self, summary, samples):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        filename = f"resources_{int(summary['start'] * 1000)}.json"
+        with open(os.path.join(self.profile_dir, filename), "w") as f:
+            json.dump({"summary": summary, "samples": samples}, f, indent=2)
+        with open(os.path.join(self.profile_dir, "resource_aggregates.json"), "w") as f:
+            json.dump(self.aggregates, f, indent=2)
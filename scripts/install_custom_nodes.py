@@ -1,96 +1,394 @@
 #!/usr/bin/env python3
 
+import argparse
+import hashlib
 import json
 import os
+import re
+import shutil
 import subprocess
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 """
-This script is used to clone specific versions of repositories.
-It reads a JSON file containing repositories and their commit hashes, clones them into a specific directory,
-and then checks out to the specified commit.
+This script installs the custom nodes pinned in custom_nodes.json.
+Repositories are installed in parallel and without prompting. Only the pinned commit
+is fetched, through a local cache of bare repositories, so rebuilds only fetch what
+changed. Submodules are fetched shallowly too.
+
+Shallow fetches need a full commit SHA. Short SHAs are resolved against branch tips,
+and otherwise the repository's history is fetched into the cache once. Short pins that
+were resolved are then written back to custom_nodes.json as full SHAs, so later cold
+installs take the shallow path. Use --keep-short-pins to leave the file alone.
+
+Each installed package is also stored as a tarball named by a hash of its repo, pinned
+commit and config files, and later installs extract it without touching git. A marker in
+each package records the snapshot it came from, so only packages whose pin or config
+changed are replaced. Keep both caches between image builds, e.g. with a build cache mount.
+Use --no-snapshots to install git checkouts in place instead.
 """
 
 json_file = "custom_nodes.json"
 comfy_dir = "ComfyUI"
 custom_nodes_dir = f"{comfy_dir}/custom_nodes/"
+cache_dir = os.getenv(
+    "CUSTOM_NODES_GIT_CACHE", os.path.expanduser("~/.cache/cog-comfyui/custom_nodes")
+)
+snapshot_dir = os.getenv(
+    "CUSTOM_NODES_SNAPSHOT_CACHE",
+    os.path.expanduser("~/.cache/cog-comfyui/custom_node_snapshots"),
+)
+use_snapshots = True
+jobs = int(os.getenv("CUSTOM_NODES_INSTALL_JOBS", "8"))
 
-with open(json_file, "r") as file:
-    repos = json.load(file)
+# Config files that ship inside a package, so they are part of its snapshot
+PACKAGE_CONFIG_FILES = {
+    "was-node-suite-comfyui": ["custom_node_configs/was_suite_config.json"],
+    "rgthree-comfy": ["custom_node_configs/rgthree_config.json"],
+}
+COMFY_SETTINGS = {
+    "src": "custom_node_configs/comfy.settings.json",
+    "dest": os.path.join(comfy_dir, "user", "default"),
+}
+SNAPSHOT_MARKER = ".cog_snapshot"
 
-# Loop over each repository in the list
-for repo in repos:
-    repo_url = repo["repo"]
-    commit_hash = repo["commit"]
-    repo_name = os.path.basename(repo_url.replace(".git", ""))
+FULL_SHA = re.compile(r"^[0-9a-f]{40}$")
+# Never wait on a credential prompt for a private or missing repository
+GIT_ENV = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}
 
-    # Check if the repository directory already exists
-    repo_path = os.path.join(custom_nodes_dir, repo_name)
-    if not os.path.isdir(repo_path):
-        # Clone the repository into the destination directory
-        print(
-            f"Cloning {repo_url} into {repo_path} and checking out to commit {commit_hash}"
-        )
-        subprocess.run(["git", "clone", "--recursive", repo_url, repo_path])
 
-        # Store the current directory and change to the repository's directory
-        current_dir = os.getcwd()
-        os.chdir(repo_path)
-        subprocess.run(["git", "checkout", commit_hash])
-        subprocess.run(["git", "submodule", "update", "--init", "--recursive"])
+class InstallError(Exception):
+    pass
+
+
+def git(*args, cwd=None):
+    result = subprocess.run(
+        ["git", *args], cwd=cwd, env=GIT_ENV, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise InstallError(f"git {' '.join(args)}: {result.stderr.strip()}")
+    return result.stdout.strip()
+
+
+def repo_name(repo_url):
+    return os.path.basename(repo_url.replace(".git", ""))
+
+
+def cache_path(repo_url):
+    return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9._-]+", "_", repo_url) + ".git")
+
+
+def resolve_in_cache(bare_path, commit):
+    try:
+        return git("rev-parse", "--verify", "--quiet", f"{commit}^{{commit}}", cwd=bare_path)
+    except InstallError:
+        return None
+
+
+def remote_commits(repo_url):
+    """The commits at the remote's branch and tag tips"""
+    refs = {}
+    for line in git("ls-remote", "--heads", "--tags", repo_url).splitlines():
+        sha, ref = line.split("\t")
+        refs[ref] = sha
+    # An annotated tag is listed with its own object, then peeled to its
+    # commit as "<tag>^{}". Lightweight tags point at the commit directly.
+    return {
+        refs.get(f"{ref}^{{}}", sha)
+        for ref, sha in refs.items()
+        if not ref.endswith("^{}")
+    }
 
-        # Change back to the original directory after operations
-        os.chdir(current_dir)
-    else:
-        current_dir = os.getcwd()
-        os.chdir(repo_path)
 
-        current_commit = (
-            subprocess.check_output(["git", "rev-parse", "HEAD"]).decode().strip()
+def fetch_into_cache(repo_url, commit):
+    """Makes sure the cache has the pinned commit, and returns its full SHA"""
+    bare_path = cache_path(repo_url)
+    if not os.path.isdir(bare_path):
+        os.makedirs(bare_path)
+        git("init", "--quiet", "--bare", cwd=bare_path)
+
+    sha = resolve_in_cache(bare_path, commit)
+    if sha:
+        return sha, "cached"
+
+    if not FULL_SHA.match(commit):
+        # A short SHA can only be fetched directly if it is still a branch or tag tip
+        tips = remote_commits(repo_url)
+        matches = {tip for tip in tips if tip.startswith(commit)}
+        if len(matches) == 1:
+            commit = matches.pop()
+
+    if FULL_SHA.match(commit):
+        try:
+            git("fetch", "--quiet", "--depth", "1", repo_url, commit, cwd=bare_path)
+            return commit, "shallow fetch"
+        except InstallError:
+            # The server does not allow fetching commits by SHA
+            pass
+
+    git(
+        "fetch",
+        "--quiet",
+        "--tags",
+        repo_url,
+        "+refs/heads/*:refs/heads/*",
+        cwd=bare_path,
+    )
+    sha = resolve_in_cache(bare_path, commit)
+    if not sha:
+        raise InstallError(f"commit {commit} not found in {repo_url}")
+    return sha, "full fetch"
+
+
+def update_submodules(repo_path):
+    if not os.path.isfile(os.path.join(repo_path, ".gitmodules")):
+        return
+    try:
+        git(
+            "submodule", "update", "--init", "--recursive", "--depth", "1", "--jobs", "4",
+            cwd=repo_path,
         )
-        print(f"Custom node installed for {repo_name} at {current_commit[:7]}")
+    except InstallError:
+        # The pinned submodule commit is not a branch tip and the server
+        # does not allow fetching it by SHA
+        git("submodule", "update", "--init", "--recursive", "--jobs", "4", cwd=repo_path)
+
+
+def checkout(repo_path, repo_url, sha):
+    if not os.path.isdir(repo_path):
+        os.makedirs(repo_path)
+        git("init", "--quiet", cwd=repo_path)
+        git("remote", "add", "origin", repo_url, cwd=repo_path)
+    git("fetch", "--quiet", "--depth", "1", os.path.abspath(cache_path(repo_url)), sha, cwd=repo_path)
+    git("checkout", "--quiet", "--detach", sha, cwd=repo_path)
+    update_submodules(repo_path)
+
+
+def package_config_files(name):
+    return [path for path in PACKAGE_CONFIG_FILES.get(name, []) if os.path.isfile(path)]
+
+
+def copy_package_config_files(name, repo_path):
+    for path in package_config_files(name):
+        # Settings changed at runtime are kept
+        if not os.path.exists(os.path.join(repo_path, os.path.basename(path))):
+            print(f"Copying {path} to {repo_path}")
+            shutil.copy(path, repo_path)
+
+
+def keep_package_config_files(name, repo_path, new_path):
+    # Settings changed at runtime are carried over to the package replacing this one
+    for path in PACKAGE_CONFIG_FILES.get(name, []):
+        current = os.path.join(repo_path, os.path.basename(path))
+        if os.path.isfile(current):
+            shutil.copy(current, new_path)
+
+
+def snapshot_key(repo):
+    # Content addressed by everything that goes into the package
+    key = hashlib.sha256(f"{repo['repo']}\n{repo['commit']}\n".encode("utf-8"))
+    for path in package_config_files(repo_name(repo["repo"])):
+        with open(path, "rb") as f:
+            key.update(path.encode("utf-8") + b"\n" + f.read())
+    return key.hexdigest()[:24]
 
-        if current_commit[:7] != commit_hash[:7]:
-            response = input(
-                f"Do you want to update {repo_name}? Current ({current_commit[:7]}) is different from ({commit_hash[:7]}) (y/n): "
+
+def read_marker(repo_path):
+    try:
+        with open(os.path.join(repo_path, SNAPSHOT_MARKER), "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def has_local_changes(repo_path):
+    if not os.path.isdir(os.path.join(repo_path, ".git")):
+        return False
+    return bool(git("status", "--porcelain", cwd=repo_path))
+
+
+def build_snapshot(repo, key, snapshot_path):
+    """Checks out the pinned commit with git and stores it, without .git, as a tarball"""
+    name = repo_name(repo["repo"])
+    build_path = os.path.join(snapshot_dir, f"build-{key}")
+    shutil.rmtree(build_path, ignore_errors=True)
+    try:
+        sha, source = fetch_into_cache(repo["repo"], repo["commit"])
+        checkout(build_path, repo["repo"], sha)
+        copy_package_config_files(name, build_path)
+        with open(os.path.join(build_path, SNAPSHOT_MARKER), "w") as f:
+            f.write(key)
+
+        temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        with tarfile.open(temp_path, "w:gz", compresslevel=1) as tar:
+            tar.add(
+                build_path,
+                arcname=name,
+                filter=lambda info: None if os.path.basename(info.name) == ".git" else info,
             )
-            if response.lower() == "y":
-                print(f"Checking out to commit {commit_hash}")
-                subprocess.run(["git", "fetch"])
-                subprocess.run(["git", "checkout", commit_hash])
-                subprocess.run(["git", "submodule", "update", "--init", "--recursive"])
-            else:
-                print("Skipping checkout, keeping current commit")
-
-        os.chdir(current_dir)
-
-# Copy custom node config files to the correct directory
-config_files = {
-    "was_suite_config": {
-        "src": "custom_node_configs/was_suite_config.json",
-        "dest": os.path.join(custom_nodes_dir, "was-node-suite-comfyui/"),
-    },
-    "rgthree_config": {
-        "src": "custom_node_configs/rgthree_config.json",
-        "dest": os.path.join(custom_nodes_dir, "rgthree-comfy/"),
-    },
-    "comfy_settings": {
-        "src": "custom_node_configs/comfy.settings.json",
-        "dest": os.path.join(comfy_dir, "user", "default"),
-    },
-}
+        os.replace(temp_path, snapshot_path)
+    finally:
+        shutil.rmtree(build_path, ignore_errors=True)
+    return f"{sha[:7]} ({source})"
 
-if "comfy_settings" in config_files:
-    paths = config_files["comfy_settings"]
-    if not os.path.exists(paths["dest"]):
-        os.makedirs(paths["dest"])
-
-for config_file, paths in config_files.items():
-    if (
-        os.path.isfile(paths["src"])
-        and os.path.isdir(paths["dest"])
-        and not os.path.exists(
-            os.path.join(paths["dest"], os.path.basename(paths["src"]))
-        )
+
+def extract_snapshot(snapshot_path, repo_path):
+    # Extracted next to the package and swapped in, so an interrupted
+    # install never leaves half a package
+    extract_path = f"{repo_path}.extract-{os.getpid()}"
+    shutil.rmtree(extract_path, ignore_errors=True)
+    os.makedirs(extract_path)
+    with tarfile.open(snapshot_path, "r:gz") as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(extract_path, filter="data")
+        else:
+            tar.extractall(extract_path)
+    (extracted,) = os.listdir(extract_path)
+    extracted_path = os.path.join(extract_path, extracted)
+    if os.path.lexists(repo_path):
+        keep_package_config_files(os.path.basename(repo_path), repo_path, extracted_path)
+        shutil.rmtree(repo_path)
+    os.rename(extracted_path, repo_path)
+    os.rmdir(extract_path)
+
+
+def install_from_snapshot(repo, repo_path):
+    key = snapshot_key(repo)
+    marker = read_marker(repo_path)
+    if marker == key:
+        return f"already at {repo['commit'][:7]}"
+    if marker is None and os.path.isdir(repo_path) and has_local_changes(repo_path):
+        raise InstallError(f"{repo_path} has local changes, commit or remove them first")
+
+    snapshot_path = os.path.join(snapshot_dir, f"{key}.tar.gz")
+    if os.path.isfile(snapshot_path):
+        source = "snapshot"
+    else:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        source = f"new snapshot of {build_snapshot(repo, key, snapshot_path)}"
+    extract_snapshot(snapshot_path, repo_path)
+    return f"installed {repo['commit'][:7]} from {source}"
+
+
+def install_from_git(repo, repo_path):
+    repo_url = repo["repo"]
+    commit = repo["commit"]
+    name = repo_name(repo_url)
+
+    if os.path.isdir(repo_path):
+        if not os.path.isdir(os.path.join(repo_path, ".git")):
+            raise InstallError(f"{repo_path} exists but is not a git repository")
+        current_commit = git("rev-parse", "HEAD", cwd=repo_path)
+        if current_commit.startswith(commit):
+            copy_package_config_files(name, repo_path)
+            return f"already at {commit[:7]}"
+        sha, source = fetch_into_cache(repo_url, commit)
+        checkout(repo_path, repo_url, sha)
+        copy_package_config_files(name, repo_path)
+        return f"updated {current_commit[:7]} to {sha[:7]} ({source})"
+
+    sha, source = fetch_into_cache(repo_url, commit)
+    checkout(repo_path, repo_url, sha)
+    copy_package_config_files(name, repo_path)
+    return f"installed at {sha[:7]} ({source})"
+
+
+def install(repo):
+    repo_path = os.path.join(custom_nodes_dir, repo_name(repo["repo"]))
+
+    # Packages disabled for a minimal boot are installed where they were
+    if not os.path.exists(repo_path) and os.path.isdir(f"{repo_path}.disabled"):
+        os.rename(f"{repo_path}.disabled", repo_path)
+
+    if use_snapshots:
+        return install_from_snapshot(repo, repo_path)
+    return install_from_git(repo, repo_path)
+
+
+def install_all(repos):
+    print_lock = threading.Lock()
+
+    def run(repo):
+        name = repo_name(repo["repo"])
+        try:
+            result = install(repo)
+            with print_lock:
+                print(f"{name}: {result}")
+            return name, None
+        except (InstallError, OSError, tarfile.TarError) as e:
+            with print_lock:
+                print(f"{name}: failed, {e}")
+            return name, str(e)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(run, repos))
+    return [(name, error) for name, error in results if error]
+
+
+def pin_full_shas(repos):
+    """Replaces short pins with the full SHAs they resolved to in the cache"""
+    pinned = 0
+    for repo in repos:
+        bare_path = cache_path(repo["repo"])
+        if FULL_SHA.match(repo["commit"]) or not os.path.isdir(bare_path):
+            continue
+        sha = resolve_in_cache(bare_path, repo["commit"])
+        if sha and sha.startswith(repo["commit"]):
+            repo["commit"] = sha
+            pinned += 1
+    if pinned:
+        with open(json_file, "w") as file:
+            json.dump(repos, file, indent=2)
+            file.write("\n")
+        print(f"Pinned {pinned} custom nodes to full commit SHAs in {json_file}")
+
+
+def copy_comfy_settings():
+    if not os.path.exists(COMFY_SETTINGS["dest"]):
+        os.makedirs(COMFY_SETTINGS["dest"])
+    if os.path.isfile(COMFY_SETTINGS["src"]) and not os.path.exists(
+        os.path.join(COMFY_SETTINGS["dest"], os.path.basename(COMFY_SETTINGS["src"]))
     ):
-        print(f"Copying {config_file} to {paths['dest']}")
-        subprocess.run(["cp", paths["src"], paths["dest"]])
+        print(f"Copying comfy_settings to {COMFY_SETTINGS['dest']}")
+        shutil.copy(COMFY_SETTINGS["src"], COMFY_SETTINGS["dest"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Install pinned custom nodes")
+    parser.add_argument("--jobs", type=int, default=jobs, help="Repositories to install at once")
+    parser.add_argument("--cache-dir", default=cache_dir, help="Cache of bare repositories")
+    parser.add_argument(
+        "--snapshot-dir", default=snapshot_dir, help="Cache of package tarballs"
+    )
+    parser.add_argument(
+        "--no-snapshots",
+        action="store_true",
+        help="Install git checkouts in place, e.g. to work on a custom node",
+    )
+    parser.add_argument(
+        "--keep-short-pins",
+        action="store_true",
+        help=f"Do not rewrite short commit SHAs in {json_file} as full ones",
+    )
+    args = parser.parse_args()
+    jobs = args.jobs
+    cache_dir = args.cache_dir
+    snapshot_dir = args.snapshot_dir
+    use_snapshots = not args.no_snapshots
+
+    with open(json_file, "r") as file:
+        repos = json.load(file)
+
+    print(f"Installing {len(repos)} custom nodes with {jobs} jobs, caching in {cache_dir}")
+    failures = install_all(repos)
+    copy_comfy_settings()
+    if not args.keep_short_pins:
+        pin_full_shas(repos)
+
+    if failures:
+        print(f"\nFailed to install {len(failures)} custom nodes:")
+        for name, error in failures:
+            print(f"  {name}: {error}")
+        exit(1)
+    print("\nCustom nodes installed")
@@ -1,55 +1,126 @@
 #!/usr/bin/env python3
 
+import argparse
 import json
 import os
+import re
 import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.error import URLError
+from install_custom_nodes import GIT_ENV, repo_name
 
 """
-This script checks for updates to custom node repositories.
-It fetches the latest commit on the main branch for each repo,
-prompts the user if they want to update, and updates the JSON file and repo if confirmed.
+This script checks the custom node repositories in custom_nodes.json for updates.
+The latest commit on each repo's default branch is read with git ls-remote, for every repo
+at once, and GitHub's compare API says whether it is ahead of the pinned commit.
+With --apply, every repo that is ahead is updated in custom_nodes.json and CHANGELOG.md in
+one pass. Run scripts/install_custom_nodes.py afterwards to install the new commits.
 """
 
 json_file = "custom_nodes.json"
-comfy_dir = "ComfyUI"
-custom_nodes_dir = f"{comfy_dir}/custom_nodes/"
 changelog_file = "CHANGELOG.md"
 
+GITHUB_REPO = re.compile(r"^https://github\.com/([^/]+)/([^/]+?)(\.git)?/?$")
+
+
+def get_latest_commit(repo_url):
+    # The default branch, or main and then master if HEAD is not advertised
+    result = subprocess.run(
+        ["git", "ls-remote", repo_url, "HEAD", "refs/heads/main", "refs/heads/master"],
+        env=GIT_ENV,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or "git ls-remote failed")
+    refs = {}
+    for line in result.stdout.splitlines():
+        sha, ref = line.split("\t")
+        refs[ref] = sha
+    for ref in ["HEAD", "refs/heads/main", "refs/heads/master"]:
+        if ref in refs:
+            return refs[ref]
+    raise RuntimeError("no HEAD, main or master branch")
+
+
+def compare_status(repo_url, current_commit, latest_commit):
+    """GitHub's view of the latest commit: ahead, behind, diverged or identical"""
+    match = GITHUB_REPO.match(repo_url)
+    if not match:
+        return None
+    owner, name = match.group(1), match.group(2)
+    request = urllib.request.Request(
+        f"https://api.github.com/repos/{owner}/{name}/compare/{current_commit}...{latest_commit}?per_page=1",
+        headers={"Accept": "application/vnd.github+json"},
+    )
+    token = os.getenv("GITHUB_TOKEN")
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            comparison = json.loads(response.read())
+    except (URLError, ValueError) as e:
+        print(f"Could not compare {repo_name(repo_url)}: {e}")
+        return None
+    return {"status": comparison["status"], "ahead_by": comparison.get("ahead_by", 0)}
 
-def get_latest_commit(repo_path):
-    def try_branch(branch):
-        try:
-            subprocess.run(
-                ["git", "fetch", "origin", branch],
-                cwd=repo_path,
-                check=True,
-                capture_output=True,
-            )
-            result = subprocess.run(
-                ["git", "rev-parse", f"origin/{branch}"],
-                cwd=repo_path,
-                check=True,
-                capture_output=True,
-                text=True,
-            )
-            return result.stdout.strip()
-        except subprocess.CalledProcessError:
-            return None
 
+def check_repo(repo):
+    repo_url = repo["repo"]
+    current_commit = repo["commit"]
+    check = {
+        "name": repo_name(repo_url),
+        "repo": repo_url,
+        "current": current_commit[:7],
+        "latest": None,
+        "status": None,
+        "ahead_by": None,
+        "compare_url": None,
+        "error": None,
+    }
     try:
-        # Try main branch first, fall back to master
-        for branch in ["main", "master"]:
-            commit = try_branch(branch)
-            if commit:
-                return commit
+        latest_commit = get_latest_commit(repo_url)
+    except (RuntimeError, subprocess.TimeoutExpired) as e:
+        check["error"] = str(e)
+        return check
+
+    # Full SHAs let the installer fetch just the pinned commit
+    check["latest"] = latest_commit
+    if latest_commit.startswith(current_commit):
+        check["status"] = "identical"
+        return check
+
+    check["compare_url"] = f"{repo_url}/compare/{current_commit[:7]}...{latest_commit[:7]}"
+    comparison = compare_status(repo_url, current_commit, latest_commit)
+    if comparison:
+        check.update(comparison)
+    else:
+        check["status"] = "unknown"
+    return check
 
-        print(f"Failed to fetch latest commit for {repo_path}")
-        return None
 
-    except subprocess.CalledProcessError:
-        print(f"Failed to fetch latest commit for {repo_path}")
-        return None
+def check_all(repos, jobs):
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(check_repo, repos))
+
+
+def print_report(checks):
+    updates = [c for c in checks if c["status"] not in (None, "identical")]
+    up_to_date = [c for c in checks if c["status"] == "identical"]
+    failed = [c for c in checks if c["error"]]
+
+    print(f"\n{len(updates)} updates, {len(up_to_date)} up to date, {len(failed)} failed\n")
+    for check in sorted(updates, key=lambda c: c["name"].lower()):
+        status = check["status"]
+        if status == "ahead":
+            status = f"ahead by {check['ahead_by']}"
+        print(f"{check['name']}: {check['current']} -> {check['latest'][:7]} ({status})")
+        print(f"  {check['compare_url']}")
+    for check in failed:
+        print(f"{check['name']}: failed, {check['error']}")
 
 
 def update_json_file(repos):
@@ -58,9 +129,9 @@ def update_json_file(repos):
         file.write("\n")
 
 
-def update_changelog(repo_name, compare_url):
+def update_changelog(updates):
     today = datetime.now().strftime("%Y-%m-%d")
-    update_line = f"- [Updated {repo_name}]({compare_url})\n"
+    update_lines = [f"- [Updated {name}]({compare_url})\n" for name, compare_url in updates]
 
     try:
         with open(changelog_file, "r+") as file:
@@ -69,24 +140,16 @@ def update_changelog(repo_name, compare_url):
             while content and not content[0].strip():
                 content.pop(0)
 
-            if content[0].strip() != f"## {today}":
-                content.insert(0, f"## {today}\n\n")
+            if not content or content[0].strip() != f"## {today}":
+                # A blank line keeps the new section apart from the last one
+                content[0:0] = [f"## {today}\n", "\n"] + (["\n"] if content else [])
 
-            # Find the index of the current day's section
-            today_index = next(
-                (i for i, line in enumerate(content) if line.strip() == f"## {today}"),
-                None,
-            )
-
-            if today_index is not None:
-                # Insert the update line right after the current day's header
-                content.insert(today_index + 1, update_line)
-            else:
-                # If today's section wasn't found (which shouldn't happen), append to the top
-                content.insert(2, update_line)
+            # Insert the update lines right after the current day's header
+            content[2:2] = update_lines
 
             file.seek(0)
             file.writelines(content)
+            file.truncate()
     except FileNotFoundError:
         print(
             f"Warning: Changelog file '{changelog_file}' not found. Skipping changelog update."
@@ -95,61 +158,50 @@ def update_changelog(repo_name, compare_url):
         print(f"Error updating changelog: {e}")
 
 
-with open(json_file, "r") as file:
-    repos = json.load(file)
-
-# Loop over each repository in the list
-for repo in repos:
-    repo_url = repo["repo"]
-    current_commit = repo["commit"]
-    repo_name = os.path.basename(repo_url.replace(".git", ""))
-
-    print(f"\nChecking {repo_name}...")
-
-    # Check if the repository directory exists
-    repo_path = os.path.join(custom_nodes_dir, repo_name)
-    if not os.path.isdir(repo_path):
-        print(f"Repository {repo_name} not found. Skipping.")
-        continue
-
-    # Get the latest commit on the main branch
-    latest_commit = get_latest_commit(repo_path)
-
-    if latest_commit is None:
-        print(f"Failed to fetch latest commit for {repo_name}. Skipping.")
-        continue
-
-    if latest_commit[:7] != current_commit[:7]:
-        print(f"Update available for {repo_name}")
-        print(f"Current commit: {current_commit[:7]}")
-        print(f"Latest commit: {latest_commit[:7]}")
-
-        # Generate GitHub comparison URL
-        compare_url = f"{repo_url}/compare/{current_commit[:7]}...{latest_commit[:7]}"
-        print(f"Comparison URL: {compare_url}")
-
-        response = input("Do you want to update? (y/n): ")
-        if response.lower() == "y":
-            print(f"Updating {repo_name}...")
-            subprocess.run(
-                ["git", "checkout", latest_commit], cwd=repo_path, check=True
-            )
-            subprocess.run(
-                ["git", "submodule", "update", "--init", "--recursive"],
-                cwd=repo_path,
-                check=True,
-            )
-
-            repo["commit"] = latest_commit[:7]
-            update_json_file(repos)
-            update_changelog(repo_name, compare_url)
-
-            print(f"Updated {repo_name} to {latest_commit[:7]}")
-        else:
-            print(f"Skipping update for {repo_name}")
-    else:
-        print(f"{repo_name} is up to date")
-
-print(
-    "\nFinished checking for updates. custom_nodes.json and CHANGELOG.md have been updated if necessary."
-)
+def apply_updates(repos, checks):
+    # Only move pins forward. Diverged or behind usually means a fork or a
+    # commit on another branch, which needs a person to look at it.
+    to_apply = {c["repo"]: c for c in checks if c["status"] == "ahead"}
+    if not to_apply:
+        print("\nNothing to apply")
+        return
+
+    updates = []
+    for repo in repos:
+        check = to_apply.get(repo["repo"])
+        if check:
+            repo["commit"] = check["latest"]
+            updates.append((check["name"], check["compare_url"]))
+
+    update_json_file(repos)
+    update_changelog(updates)
+    print(
+        f"\nUpdated {len(updates)} custom nodes in {json_file} and {changelog_file}. "
+        "Run scripts/install_custom_nodes.py to install them."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check custom nodes for updates")
+    parser.add_argument("--jobs", type=int, default=16, help="Repositories to check at once")
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Update every repo that is ahead in custom_nodes.json and CHANGELOG.md",
+    )
+    parser.add_argument("--only", help="Comma separated repo names to check")
+    args = parser.parse_args()
+
+    with open(json_file, "r") as file:
+        repos = json.load(file)
+
+    selected = repos
+    if args.only:
+        names = {name.strip() for name in args.only.split(",")}
+        selected = [repo for repo in repos if repo_name(repo["repo"]) in names]
+
+    print(f"Checking {len(selected)} custom nodes for updates...")
+    checks = check_all(selected, args.jobs)
+    print_report(checks)
+    if args.apply:
+        apply_updates(repos, checks)
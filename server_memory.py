@@ -0,0 +1,102 @@
+import time
+import psutil
+from collections import deque
+
+MAX_MEMORY_SAMPLES = 1000
+
+
+def process_tree(pid):
+    # The server runs under a shell, so include every child process
+    if pid is None:
+        return []
+    try:
+        process = psutil.Process(pid)
+        return [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def process_tree_rss(pid):
+    rss = 0
+    for process in process_tree(pid):
+        try:
+            rss += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return rss
+
+
+def process_tree_stats(pid):
+    # Totals across the process tree. I/O counters are not available everywhere.
+    stats = {
+        "processes": 0,
+        "rss": 0,
+        "cpu_seconds": 0.0,
+        "threads": 0,
+        "open_files": 0,
+        "read_bytes": 0,
+        "write_bytes": 0,
+    }
+    for process in process_tree(pid):
+        try:
+            with process.oneshot():
+                cpu_times = process.cpu_times()
+                stats["rss"] += process.memory_info().rss
+                stats["cpu_seconds"] += cpu_times.user + cpu_times.system
+                stats["threads"] += process.num_threads()
+                stats["open_files"] += len(process.open_files())
+                if hasattr(process, "io_counters"):
+                    io_counters = process.io_counters()
+                    stats["read_bytes"] += io_counters.read_bytes
+                    stats["write_bytes"] += io_counters.write_bytes
+                stats["processes"] += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return stats
+
+
+class ServerMemoryMonitor:
+    """
+    Records the RSS of the ComfyUI process tree after each prediction so a
+    long-lived worker can confirm memory stays flat.
+    """
+
+    def __init__(self, max_samples=MAX_MEMORY_SAMPLES):
+        self.samples = deque(maxlen=max_samples)
+
+    def record(self, pid):
+        rss = process_tree_rss(pid)
+        self.samples.append((time.time(), rss))
+        return rss
+
+    def trend(self):
+        # Least squares slope of RSS over time, in MB per hour
+        if len(self.samples) < 2:
+            return None
+
+        times = [sample[0] for sample in self.samples]
+        values = [sample[1] / (1024 * 1024) for sample in self.samples]
+        mean_time = sum(times) / len(times)
+        mean_value = sum(values) / len(values)
+        variance = sum((t - mean_time) ** 2 for t in times)
+        if variance == 0:
+            return None
+
+        slope = (
+            sum((t - mean_time) * (v - mean_value) for t, v in zip(times, values))
+            / variance
+        )
+        return {
+            "samples": len(self.samples),
+            "rss_mb": values[-1],
+            "min_rss_mb": min(values),
+            "max_rss_mb": max(values),
+            "mb_per_hour": slope * 3600,
+        }
+
+    def print_trend(self):
+        trend = self.trend()
+        if trend:
+            print(
+                f"ComfyUI RSS: {trend['rss_mb']:.0f}MB, trend {trend['mb_per_hour']:+.1f}MB/hour over {trend['samples']} predictions"
+            )
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import time
+import threading
+import psutil
+import tracing
+from execution_profiler import PROFILE_DIR
+
+# Where to write the startup profile as JSON. Defaults to COMFYUI_PROFILE_DIR.
+STARTUP_PROFILE_PATH = os.getenv("COMFYUI_STARTUP_PROFILE") or (
+    os.path.join(PROFILE_DIR, "startup_profile.json") if PROFILE_DIR else None
+)
+TOP_CONTRIBUTORS = 15
+
+# ComfyUI logs a section like this for prestartup scripts and for imports:
+#   Import times for custom nodes:
+#      0.3 seconds: /src/ComfyUI/custom_nodes/ComfyUI_IPAdapter_plus
+#      0.1 seconds (IMPORT FAILED): /src/ComfyUI/custom_nodes/broken_node
+COMFYUI_TIMING_SECTIONS = {
+    "Prestartup times for custom nodes:": "custom node prestartup",
+    "Import times for custom nodes:": "custom node import",
+}
+COMFYUI_TIMING_LINE = re.compile(r"^\s*([\d.]+) seconds( \(IMPORT FAILED\))?: (.+)$")
+
+
+class StartupProfile:
+    """
+    Collects where cold start time goes: the interpreter and wrapper imports,
+    each custom_node_helpers module, the setup phases (from tracing spans),
+    and ComfyUI's own custom node import times parsed from its log.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.lock = threading.Lock()
+        # The timing section each log stream is in. stdout and stderr are read
+        # by separate threads, so a section is only continued by its own stream.
+        self.comfyui_sections = {}
+
+    def record(self, category, name, seconds, **details):
+        with self.lock:
+            self.entries.append(
+                {"category": category, "name": name, "seconds": seconds, **details}
+            )
+
+    def _record_span(self, span):
+        name = span.name
+        if "weight" in span.attributes:
+            name = f"{name} {span.attributes['weight']}"
+        self.record(
+            "setup",
+            name,
+            span.end - span.start,
+            span_id=span.id,
+            parent_id=span.parent.id if span.parent else None,
+        )
+
+    def begin(self):
+        # Everything before setup starts is the interpreter and module imports,
+        # less the helper imports that are timed on their own
+        process_start = psutil.Process().create_time()
+        helper_imports = sum(
+            e["seconds"] for e in self.entries if e["category"] == "helper import"
+        )
+        self.record(
+            "python",
+            "interpreter and other imports",
+            time.time() - process_start - helper_imports,
+        )
+        self.setup_start = time.time()
+        tracing.add_span_listener(self._record_span)
+
+    def parse_comfyui_log_line(self, line, stream="stdout"):
+        stripped = line.strip()
+        if stripped in COMFYUI_TIMING_SECTIONS:
+            self.comfyui_sections[stream] = COMFYUI_TIMING_SECTIONS[stripped]
+            return
+        section = self.comfyui_sections.get(stream)
+        if section is None:
+            return
+
+        match = COMFYUI_TIMING_LINE.match(line)
+        if not match:
+            self.comfyui_sections[stream] = None
+            return
+        seconds, failed, path = match.groups()
+        self.record(
+            section,
+            os.path.basename(path.rstrip("/")),
+            float(seconds),
+            failed=bool(failed),
+        )
+
+    def finish(self):
+        tracing.remove_span_listener(self._record_span)
+        total = time.time() - self.setup_start
+        with self.lock:
+            entries = list(self.entries)
+
+        # What ComfyUI spends booting outside custom node imports
+        boot = sum(e["seconds"] for e in entries if e["name"] == "boot server")
+        custom_nodes = sum(
+            e["seconds"] for e in entries if e["category"].startswith("custom node")
+        )
+        if boot:
+            entries.append(
+                {
+                    "category": "comfyui",
+                    "name": "ComfyUI core startup",
+                    "seconds": max(0.0, boot - custom_nodes),
+                }
+            )
+
+        # Setup spans nest, so only rank the innermost ones. Booting the server
+        # is already broken down into ComfyUI's own timings.
+        parent_ids = {e["parent_id"] for e in entries if e.get("parent_id")}
+        ranked = sorted(
+            [
+                e
+                for e in entries
+                if e.get("span_id", "") not in parent_ids and e["name"] != "boot server"
+            ],
+            key=lambda e: e["seconds"],
+            reverse=True,
+        )
+        profile = {
+            "setup_seconds": total,
+            "custom_node_import_seconds": custom_nodes,
+            "entries": ranked,
+        }
+        self.print_report(profile)
+        if STARTUP_PROFILE_PATH:
+            self.write(profile)
+        return profile
+
+    def print_report(self, profile):
+        print(
+            f"Setup took {profile['setup_seconds']:.2f}s, ComfyUI custom node imports took {profile['custom_node_import_seconds']:.2f}s"
+        )
+        print("Biggest startup contributors:")
+        for entry in profile["entries"][:TOP_CONTRIBUTORS]:
+            failed = " (import failed)" if entry.get("failed") else ""
+            print(
+                f"  {entry['seconds']:.2f}s {entry['category']}: {entry['name']}{failed}"
+            )
+
+    def write(self, profile):
+        directory = os.path.dirname(STARTUP_PROFILE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(STARTUP_PROFILE_PATH, "w") as f:
+            json.dump(profile, f, indent=2)
+        print(f"Startup profile written to {STARTUP_PROFILE_PATH}")
+
+
+startup_profile = StartupProfile()
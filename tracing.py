@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import uuid
+import functools
+import threading
+import contextvars
+
+# Write a timeline of each prediction to this directory. Tracing is off when unset.
+TRACE_DIR = os.getenv("COMFYUI_TRACE_DIR")
+# "chrome" for chrome://tracing and Perfetto, "json" for the raw spans, or "both"
+TRACE_FORMAT = os.getenv("COMFYUI_TRACE_FORMAT", "chrome")
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+# Called with every finished span, traced or not, e.g. to record metrics
+_span_listeners = []
+
+
+class NullSpan:
+    # Returned when tracing is off, so disabled spans cost one lookup
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    # trace is None when a span is only timed for the span listeners
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.id = uuid.uuid4().hex[:8]
+        self.parent = None
+        self.start = None
+        self.end = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.start = time.time()
+        # Restored by hand rather than with a token, as spans in generators
+        # can be closed after the context they were opened in has changed
+        _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.time()
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc_value}"
+        _current_span.set(self.parent)
+        self.finish()
+        return False
+
+    def finish(self):
+        if self.trace is not None:
+            self.trace.add(self)
+        for listener in _span_listeners:
+            listener(self)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "parent": self.parent.id if self.parent else None,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration": self.end - self.start,
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+
+
+class Trace(Span):
+    """
+    The root span of a prediction. Every span opened while it is current is
+    recorded on it, and the timeline is written out when it closes.
+    """
+
+    def __init__(self, name, attributes):
+        super().__init__(self, name, attributes)
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        span.thread = threading.current_thread().name
+        with self.lock:
+            self.spans.append(span)
+
+    def __enter__(self):
+        install_log_prefix()
+        self.previous_trace = _current_trace.get()
+        _current_trace.set(self)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        _current_trace.set(self.previous_trace)
+        try:
+            self.write(TRACE_DIR)
+        except OSError as e:
+            print(f"Failed to write trace {self.trace_id}: {e}")
+        return False
+
+    def to_json(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "spans": [span.to_dict() for span in sorted(self.spans, key=lambda s: s.start)],
+        }
+
+    def chrome_trace(self):
+        threads = {}
+        events = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": self.name,
+                    "ph": "X",
+                    "ts": (span.start - self.start) * 1e6,
+                    "dur": (span.end - span.start) * 1e6,
+                    "pid": 1,
+                    "tid": threads.setdefault(span.thread, len(threads) + 1),
+                    "args": {**span.attributes, "trace_id": self.trace_id},
+                }
+            )
+        for thread, tid in threads.items():
+            events.append(
+                {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread}}
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, trace_dir):
+        os.makedirs(trace_dir, exist_ok=True)
+        files = {}
+        if TRACE_FORMAT in ("json", "both"):
+            files[f"{self.trace_id}.json"] = self.to_json()
+        if TRACE_FORMAT in ("chrome", "both"):
+            files[f"{self.trace_id}.trace.json"] = self.chrome_trace()
+        for filename, content in files.items():
+            with open(os.path.join(trace_dir, filename), "w") as f:
+                json.dump(content, f, indent=2)
+        print(f"Trace written to {trace_dir}/{self.trace_id}")
+
+
+def trace(name, **attributes):
+    """Starts a trace, e.g. `with tracing.trace("predict"):`"""
+    if not TRACE_DIR:
+        return NULL_SPAN
+    return Trace(name, attributes)
+
+
+def span(name, **attributes):
+    """Opens a span in the current trace, if there is one"""
+    current = _current_trace.get()
+    if current is None and not _span_listeners:
+        return NULL_SPAN
+    return Span(current, name, attributes)
+
+
+def record(name, start, end=None, **attributes):
+    # For work in generators, where a span left open across a yield would
+    # also cover whatever the consumer does in between
+    current = _current_trace.get()
+    if current is None and not _span_listeners:
+        return
+    completed = Span(current, name, attributes)
+    completed.parent = _current_span.get()
+    completed.start = start
+    completed.end = end or time.time()
+    completed.finish()
+
+
+def add_span_listener(listener):
+    _span_listeners.append(listener)
+
+
+def remove_span_listener(listener):
+    if listener in _span_listeners:
+        _span_listeners.remove(listener)
+
+
+def current_trace_id():
+    current = _current_trace.get()
+    return current.trace_id if current else None
+
+
+def wrap_context(fn):
+    # Threads start with an empty context, so carry the trace into pool work
+    if _current_trace.get() is None:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+class TracePrefixStream:
+    """
+    Prefixes lines printed in a traced context with the trace id, so log
+    lines can be matched to a trace. Other threads, such as the ComfyUI
+    log reader, are left as they are.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.at_line_start = True
+
+    def write(self, text):
+        trace_id = current_trace_id()
+        if trace_id is None or not text:
+            self.at_line_start = text.endswith("\n") if text else self.at_line_start
+            return self.stream.write(text)
+
+        prefix = f"[trace {trace_id[:8]}] "
+        lines = text.split("\n")
+        output = []
+        for index, line in enumerate(lines):
+            starts_line = self.at_line_start if index == 0 else True
+            if line and starts_line:
+                line = prefix + line
+            output.append(line)
+        self.at_line_start = text.endswith("\n")
+        return self.stream.write("\n".join(output))
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def install_log_prefix():
+    if not isinstance(sys.stdout, TracePrefixStream):
+        sys.stdout = TracePrefixStream(sys.stdout)
+
+
+def traced(name):
+    """Decorator that runs a function in a span"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def traced_generator(name):
+    """
+    Decorator that runs a generator in a trace. The trace is only current
+    while the generator runs, not while the consumer handles what it yielded.
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            root = trace(name)
+            if root is NULL_SPAN:
+                return (yield from fn(*args, **kwargs))
+
+            # The trace is set in a context of its own, entered for each step
+            context = contextvars.copy_context()
+            context.run(root.__enter__)
+            generator = fn(*args, **kwargs)
+            exc_info = (None, None, None)
+            try:
+                value = context.run(next, generator)
+                while True:
+                    try:
+                        yield value
+                    except BaseException as e:
+                        # GeneratorExit when the consumer closes us early
+                        value = context.run(generator.throw, e)
+                    else:
+                        value = context.run(next, generator)
+            except StopIteration as stop:
+                return stop.value
+            except BaseException as e:
+                exc_info = (type(e), e, e.__traceback__)
+                raise
+            finally:
+                context.run(root.__exit__, *exc_info)
+
+        return wrapper
+
+    return decorator
@@ -1,7 +1,44 @@
 import subprocess
 import time
 import os
-from weights_manifest import WeightsManifest
+from concurrent.futures import ThreadPoolExecutor
+from weights_manifest import WeightsManifest, MODELS_PATH
+import tracing
+import metrics
+
+# Marker written next to a weight while it downloads in the background.
+# Must match PENDING_SUFFIX in cog_comfyui_nodes/weights_readiness.py
+PENDING_SUFFIX = ".cog-pending"
+
+# Model folders whose loaders resolve files through folder_paths.get_full_path,
+# and so wait for a background download to finish before reading the file
+PIPELINED_WEIGHT_FOLDERS = [
+    "checkpoints",
+    "clip",
+    "clip_vision",
+    "controlnet",
+    "diffusion_models",
+    "ipadapter",
+    "loras",
+    "style_models",
+    "text_encoders",
+    "unet",
+    "upscale_models",
+    "vae",
+]
+MAX_BACKGROUND_DOWNLOADS = int(os.getenv("MAX_BACKGROUND_DOWNLOADS", "4"))
+
+
+def path_size(path):
+    # Some weights are folders, e.g. insightface models
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
 
 class WeightsDownloader:
     supported_filetypes = [
@@ -17,13 +54,22 @@ class WeightsDownloader:
     ]
 
     def __init__(self):
-        self.weights_manifest = WeightsManifest()
+        with tracing.span("load weights manifest"):
+            self.weights_manifest = WeightsManifest()
         self.weights_map = self.weights_manifest.weights_map
+        self.download_pool = ThreadPoolExecutor(max_workers=MAX_BACKGROUND_DOWNLOADS)
+        self.background_downloads = {}
+        self.download_times = {}
 
     def get_weights_by_type(self, type):
         return self.weights_manifest.get_weights_by_type(type)
 
     def download_weights(self, weight_str):
+        self.discard_failed_download(weight_str)
+        if weight_str in self.background_downloads:
+            self.background_downloads[weight_str].result()
+            return
+
         if weight_str in self.weights_map:
             if self.weights_manifest.is_non_commercial_only(weight_str):
                 print(
@@ -46,22 +92,137 @@ class WeightsDownloader:
                 f"{weight_str} unavailable. View the list of available weights: https://github.com/fofr/cog-comfyui/blob/main/supported_weights.md"
             )
 
-    def check_if_file_exists(self, weight_str, dest):
+    def weight_path(self, weight_str, dest):
         if dest.endswith(weight_str):
-            path_string = dest
-        else:
-            path_string = os.path.join(dest, weight_str)
-        return os.path.exists(path_string)
+            return dest
+        return os.path.join(dest, weight_str)
+
+    def check_if_file_exists(self, weight_str, dest):
+        path_string = self.weight_path(weight_str, dest)
+        return os.path.exists(path_string) and not os.path.exists(
+            path_string + PENDING_SUFFIX
+        )
 
     def download_if_not_exists(self, weight_str, url, dest):
-        if self.check_if_file_exists(weight_str, dest):
-            print(f"✅ {weight_str} exists in {dest}")
+        with tracing.span("download weight", weight=weight_str, dest=dest) as span:
+            if self.check_if_file_exists(weight_str, dest):
+                print(f"✅ {weight_str} exists in {dest}")
+                span.set(cached=True)
+                metrics.WEIGHT_CACHE.labels("hit").inc()
+                return
+
+            span.set(cached=False)
+            metrics.WEIGHT_CACHE.labels("miss").inc()
+            if weight_str == "realvisxlV40_v40Bakedvae.safetensors":
+                self.download_realvis_xl_v40(dest)
+            else:
+                self.download(weight_str, url, dest)
+            metrics.DOWNLOADED_BYTES.labels("weights").inc(
+                path_size(self.weight_path(weight_str, dest))
+            )
+
+            # Left behind if a previous process stopped mid-download
+            marker = self.weight_path(weight_str, dest) + PENDING_SUFFIX
+            if os.path.exists(marker):
+                os.remove(marker)
+
+    def can_download_in_background(self, weight_str):
+        if weight_str not in self.weights_map:
+            return False
+        entries = self.weights_map[weight_str]
+        entries = entries if isinstance(entries, list) else [entries]
+        return any(weight_str.endswith(ft) for ft in self.supported_filetypes) and all(
+            os.path.relpath(entry["dest"], MODELS_PATH).split(os.sep)[0]
+            in PIPELINED_WEIGHT_FOLDERS
+            for entry in entries
+        )
+
+    def download_weights_in_background(self, weight_str):
+        """
+        Starts downloading a weight without waiting for it to finish.
+
+        Until it finishes, an empty placeholder file lets ComfyUI accept a
+        prompt that uses the weight, and a marker file next to it makes the
+        loader node wait (see cog_comfyui_nodes/weights_readiness.py).
+        Weights that can't be loaded this way are downloaded straight away.
+        """
+        self.discard_failed_download(weight_str)
+        if weight_str in self.background_downloads:
             return
-        
-        if weight_str == "realvisxlV40_v40Bakedvae.safetensors":
-            self.download_realvis_xl_v40(dest)
-        else:
-            self.download(weight_str, url, dest)
+        if not self.can_download_in_background(weight_str):
+            return self.download_weights(weight_str)
+
+        entries = self.weights_map[weight_str]
+        entries = entries if isinstance(entries, list) else [entries]
+        pending = [
+            entry
+            for entry in entries
+            if not self.check_if_file_exists(weight_str, entry["dest"])
+        ]
+        if not pending:
+            print(f"✅ {weight_str} exists")
+            return
+
+        for entry in pending:
+            path = self.weight_path(weight_str, entry["dest"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path + PENDING_SUFFIX, "w").close()
+            if not os.path.exists(path):
+                open(path, "w").close()
+
+        if self.weights_manifest.is_non_commercial_only(weight_str):
+            print(
+                f"⚠️  {weight_str} is for non-commercial use only. Unless you have obtained a commercial license.\nDetails: https://github.com/fofr/cog-comfyui/blob/main/weights_licenses.md"
+            )
+
+        print(f"⏳ Downloading {weight_str} in the background")
+        self.background_downloads[weight_str] = self.download_pool.submit(
+            tracing.wrap_context(self._download_in_background), weight_str, pending
+        )
+
+    def _download_in_background(self, weight_str, entries):
+        start = time.time()
+        for entry in entries:
+            path = self.weight_path(weight_str, entry["dest"])
+            try:
+                if os.path.exists(path) and os.path.getsize(path) == 0:
+                    os.remove(path)
+                self.download_if_not_exists(weight_str, entry["url"], entry["dest"])
+            finally:
+                if os.path.exists(path + PENDING_SUFFIX):
+                    os.remove(path + PENDING_SUFFIX)
+        self.download_times[weight_str] = (start, time.time())
+
+    def discard_failed_download(self, weight_str):
+        # So a failed download is retried rather than re-raised every prediction
+        future = self.background_downloads.get(weight_str)
+        if future is not None and future.done() and future.exception():
+            print(f"Retrying {weight_str}, its background download failed: {future.exception()}")
+            del self.background_downloads[weight_str]
+            self.download_times.pop(weight_str, None)
+
+    def discard_finished_downloads(self):
+        """
+        Forgets downloads that have finished, after a prediction that did not
+        wait for them. Ones still running are kept, so later predictions wait
+        on them instead of starting them again.
+        """
+        for weight_str, future in list(self.background_downloads.items()):
+            if future.done():
+                del self.background_downloads[weight_str]
+                self.download_times.pop(weight_str, None)
+
+    def wait_for_background_downloads(self):
+        # Returns the (start, end) times of the downloads that were in flight
+        downloads = self.background_downloads
+        self.background_downloads = {}
+        for future in downloads.values():
+            future.result()
+        return {
+            weight_str: self.download_times.pop(weight_str)
+            for weight_str in downloads
+            if weight_str in self.download_times
+        }
 
     def download_realvis_xl_v40(self, dest):
         """
@@ -0,0 +1,194 @@
+import os
+import json
+import hashlib
+
+# Nodes that only show results in the ComfyUI editor. Their outputs never
+# reach a saved file, so they and anything only they use can be dropped.
+DEBUG_NODE_CLASSES = [
+    "PreviewImage",
+    "PreviewAudio",
+    "PreviewBridge",
+    "PreviewBridgeLatent",
+    "MaskPreview+",
+    "ImpactPreview",
+    "Image Comparer (rgthree)",
+    "Display Any (rgthree)",
+    "ShowText|pysssss",
+    "Note",
+    "MarkdownNote",
+]
+DEBUG_NODE_CLASSES.extend(
+    node_class
+    for node_class in os.getenv("COMFYUI_DEBUG_NODE_CLASSES", "").split(",")
+    if node_class
+)
+
+
+def is_link(value):
+    # Links are [node_id, output_index]
+    return (
+        isinstance(value, list)
+        and len(value) == 2
+        and isinstance(value[0], str)
+        and isinstance(value[1], int)
+    )
+
+
+def upstream_node_ids(node):
+    return [value[0] for value in node.get("inputs", {}).values() if is_link(value)]
+
+
+def output_node_ids(workflow, output_node_classes=None, debug_node_classes=None):
+    """
+    Output nodes are the nodes of output_node_classes when those are known.
+    Otherwise every node that nothing else uses is treated as an output.
+    """
+    debug_node_classes = debug_node_classes or DEBUG_NODE_CLASSES
+    if output_node_classes is not None:
+        candidates = [
+            node_id
+            for node_id, node in workflow.items()
+            if node.get("class_type") in output_node_classes
+        ]
+    else:
+        used = {
+            upstream_id
+            for node in workflow.values()
+            for upstream_id in upstream_node_ids(node)
+        }
+        candidates = [node_id for node_id in workflow if node_id not in used]
+
+    return [
+        node_id
+        for node_id in candidates
+        if workflow[node_id].get("class_type") not in debug_node_classes
+    ]
+
+
+def prune_unreachable_nodes(
+    workflow, output_node_classes=None, debug_node_classes=None
+):
+    """
+    Walks back from the output nodes and drops every node they don't depend on.
+    Returns a new workflow (nodes are shared, not copied) and the number of
+    nodes removed.
+    """
+    stack = output_node_ids(workflow, output_node_classes, debug_node_classes)
+    if not stack:
+        print("No output nodes found, not pruning workflow")
+        return workflow, 0
+
+    reachable = set()
+    while stack:
+        node_id = stack.pop()
+        if node_id in reachable or node_id not in workflow:
+            continue
+        reachable.add(node_id)
+        stack.extend(upstream_node_ids(workflow[node_id]))
+
+    pruned = {
+        node_id: node for node_id, node in workflow.items() if node_id in reachable
+    }
+    removed = [node_id for node_id in workflow if node_id not in reachable]
+    if removed:
+        removed_classes = ", ".join(
+            sorted({workflow[node_id].get("class_type", "Unknown") for node_id in removed})
+        )
+        print(f"Pruned {len(removed)} nodes not needed for outputs: {removed_classes}")
+    return pruned, len(removed)
+
+
+def topological_order(workflow):
+    # Upstream nodes come before the nodes that use them
+    order = []
+    visited = set()
+    for root_id in workflow:
+        stack = [(root_id, False)]
+        while stack:
+            node_id, expanded = stack.pop()
+            if expanded:
+                order.append(node_id)
+                continue
+            if node_id in visited or node_id not in workflow:
+                continue
+            visited.add(node_id)
+            stack.append((node_id, True))
+            for upstream_id in reversed(upstream_node_ids(workflow[node_id])):
+                stack.append((upstream_id, False))
+    return order
+
+
+def node_hashes(workflow):
+    """
+    Hashes every node by its class_type and inputs, with each link replaced
+    by the hash of the node it comes from. Nodes with the same hash compute
+    the same result.
+    """
+    hashes = {}
+    for node_id in topological_order(workflow):
+        node = workflow[node_id]
+        inputs = {
+            key: ["link", hashes.get(value[0], value[0]), value[1]]
+            if is_link(value)
+            else value
+            for key, value in node.get("inputs", {}).items()
+        }
+        signature = json.dumps(
+            [node.get("class_type"), inputs], sort_keys=True, default=str
+        )
+        hashes[node_id] = hashlib.sha256(signature.encode("utf-8")).hexdigest()
+    return hashes
+
+
+def merge_duplicate_nodes(workflow, unmergeable_classes=()):
+    """
+    Merges nodes that compute the same result, e.g. the same checkpoint or
+    image loaded twice, and points their users at the node that is kept.
+    Output nodes (nodes nothing else uses) and unmergeable_classes, nodes
+    whose result depends on their node id, are never merged.
+    Returns a new workflow, copying only nodes whose links change, and the
+    number of nodes removed.
+    """
+    hashes = node_hashes(workflow)
+    used = {
+        upstream_id
+        for node in workflow.values()
+        for upstream_id in upstream_node_ids(node)
+    }
+
+    kept_by_hash = {}
+    replacements = {}
+    for node_id in topological_order(workflow):
+        if node_id not in used:
+            continue
+        if workflow[node_id].get("class_type") in unmergeable_classes:
+            continue
+        kept_id = kept_by_hash.setdefault(hashes[node_id], node_id)
+        if kept_id != node_id:
+            replacements[node_id] = kept_id
+
+    if not replacements:
+        return workflow, 0
+
+    merged = {}
+    for node_id, node in workflow.items():
+        if node_id in replacements:
+            continue
+        inputs = node.get("inputs", {})
+        if any(is_link(v) and v[0] in replacements for v in inputs.values()):
+            node = {
+                **node,
+                "inputs": {
+                    key: [replacements[value[0]], value[1]]
+                    if is_link(value) and value[0] in replacements
+                    else value
+                    for key, value in inputs.items()
+                },
+            }
+        merged[node_id] = node
+
+    for node_id, kept_id in replacements.items():
+        print(
+            f"Merged duplicate node {node_id} into {kept_id}, class type: {workflow[node_id].get('class_type', 'Unknown')}"
+        )
+    return merged, len(replacements)
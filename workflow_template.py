@@ -0,0 +1,66 @@
+import workflow_optimiser
+
+
+def with_inputs(node, /, class_type=None, **changes):
+    """
+    A copy of a node with some inputs (and optionally its class_type)
+    changed. Nodes can be shared with a workflow template, so they are
+    copied rather than changed in place.
+    """
+    copy = {**node, "inputs": {**node.get("inputs", {}), **changes}}
+    if class_type is not None:
+        copy["class_type"] = class_type
+    return copy
+
+
+class WorkflowTemplate:
+    """
+    A workflow parsed once, with named bindings to the inputs that change
+    per request, e.g. {"seed": [("81", "seed")]}.
+
+    Bindings are checked when the template is created, so a wrong node id or
+    input name fails at setup rather than mid-request. render() copies only
+    the nodes it patches; every other node is shared with the template and
+    must not be modified.
+    """
+
+    def __init__(self, workflow, bindings):
+        self.workflow = workflow
+        self.bindings = {
+            name: [tuple(path) for path in paths] for name, paths in bindings.items()
+        }
+        self._validate_bindings()
+
+    def _validate_bindings(self):
+        errors = []
+        for name, paths in self.bindings.items():
+            for node_id, input_key in paths:
+                node = self.workflow.get(node_id)
+                if node is None:
+                    errors.append(f"{name}: node {node_id} does not exist")
+                elif input_key not in node.get("inputs", {}):
+                    errors.append(
+                        f"{name}: node {node_id} ({node.get('class_type')}) has no input '{input_key}'"
+                    )
+                elif workflow_optimiser.is_link(node["inputs"][input_key]):
+                    errors.append(
+                        f"{name}: input '{input_key}' of node {node_id} is a link, not a value"
+                    )
+        if errors:
+            raise ValueError("Invalid workflow bindings:\n" + "\n".join(errors))
+
+    def render(self, **values):
+        changes = {}
+        for name, value in values.items():
+            if value is None:
+                continue
+            if name not in self.bindings:
+                raise KeyError(f"Workflow template has no binding named '{name}'")
+
+            for node_id, input_key in self.bindings[name]:
+                changes.setdefault(node_id, {})[input_key] = value
+
+        prompt = dict(self.workflow)
+        for node_id, inputs in changes.items():
+            prompt[node_id] = with_inputs(prompt[node_id], **inputs)
+        return prompt
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import hashlib
+import subprocess
+import urllib.request
+from workflow_optimiser import is_link
+
+OBJECT_INFO_CACHE_DIR = "ComfyUI/user/object_info_cache"
+CUSTOM_NODES_JSON = "custom_nodes.json"
+WRAPPER_NODES_PATH = "cog_comfyui_nodes"
+
+# Combo values that name a file (weights, inputs) are checked elsewhere, since
+# the server's file lists go stale as weights are downloaded on demand
+FILE_VALUE_PATTERN = re.compile(r"\.[A-Za-z0-9]{2,12}( \[\w+\])?$")
+
+# ComfyUI coerces primitive inputs like this before checking them, so
+# e.g. INT accepts 20.0 and STRING accepts a number
+PRIMITIVE_TYPES = {
+    "INT": int,
+    "FLOAT": float,
+    "STRING": str,
+    "BOOLEAN": bool,
+}
+
+
+def comfyui_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "-C", "ComfyUI", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return "unknown"
+
+
+def object_info_cache_key():
+    # The schema only changes when ComfyUI or the installed custom nodes change
+    key = hashlib.sha256(comfyui_commit().encode("utf-8"))
+    paths = [CUSTOM_NODES_JSON] + [
+        os.path.join(WRAPPER_NODES_PATH, f)
+        for f in sorted(os.listdir(WRAPPER_NODES_PATH))
+        if f.endswith(".py")
+    ]
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                key.update(f.read())
+    return key.hexdigest()[:16]
+
+
+def object_info_cache_path(cache_dir=OBJECT_INFO_CACHE_DIR):
+    return os.path.join(cache_dir, f"object_info_{object_info_cache_key()}.json")
+
+
+def types_match(expected, actual):
+    if expected == "*" or actual == "*":
+        return True
+    return bool(set(expected.split(",")) & set(actual.split(",")))
+
+
+class WorkflowValidator:
+    """
+    Checks a workflow against ComfyUI's /object_info schema before it is
+    queued, so a bad workflow fails with a precise error straight away.
+    """
+
+    def __init__(self, object_info):
+        self.object_info = object_info
+
+    @classmethod
+    def load(cls, server_address, cache_dir=OBJECT_INFO_CACHE_DIR):
+        cache_path = object_info_cache_path(cache_dir)
+        if os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                return cls(json.load(f))
+
+        print("Fetching node schema from /object_info")
+        with urllib.request.urlopen(f"http://{server_address}/object_info") as response:
+            object_info = json.loads(response.read())
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump(object_info, f)
+        return cls(object_info)
+
+    def output_node_classes(self):
+        return {
+            class_type
+            for class_type, info in self.object_info.items()
+            if info.get("output_node")
+        }
+
+    def node_id_dependent_classes(self):
+        # Nodes given their own id or the whole prompt, which ComfyUI caches per node
+        return {
+            class_type
+            for class_type, info in self.object_info.items()
+            if {"UNIQUE_ID", "PROMPT"}
+            & set(info.get("input", {}).get("hidden", {}).values())
+        }
+
+    def validate(self, workflow):
+        errors = []
+        for node_id, node in workflow.items():
+            class_type = node.get("class_type")
+            if class_type not in self.object_info:
+                errors.append(
+                    f"Node {node_id}: '{class_type}' is not an installed node type"
+                )
+                continue
+
+            schema = self.object_info[class_type].get("input", {})
+            required = schema.get("required", {})
+            inputs = node.get("inputs", {})
+            for name in required:
+                if name not in inputs:
+                    errors.append(
+                        f"Node {node_id} ({class_type}): missing required input '{name}'"
+                    )
+
+            specs = {**schema.get("optional", {}), **required}
+            for name, value in inputs.items():
+                if name in specs:
+                    error = self._validate_input(workflow, value, specs[name])
+                    if error:
+                        errors.append(f"Node {node_id} ({class_type}), input '{name}': {error}")
+        return errors
+
+    def _validate_input(self, workflow, value, spec):
+        input_type = spec[0]
+        options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+        if input_type == "COMBO":
+            input_type = options.get("options", [])
+
+        if is_link(value):
+            upstream_id, index = value
+            upstream = workflow.get(upstream_id)
+            if upstream is None:
+                return f"linked to node {upstream_id}, which does not exist"
+            upstream_info = self.object_info.get(upstream.get("class_type"))
+            if upstream_info is None:
+                return None
+            outputs = upstream_info.get("output", [])
+            if index >= len(outputs):
+                return f"linked to output {index} of node {upstream_id}, which has {len(outputs)} outputs"
+            # Combo inputs can be driven by primitive or switch nodes of any type
+            if isinstance(input_type, str) and isinstance(outputs[index], str):
+                if not types_match(input_type, outputs[index]):
+                    return f"expects {input_type} but node {upstream_id} outputs {outputs[index]}"
+            return None
+
+        if isinstance(input_type, list):
+            if isinstance(value, str) and FILE_VALUE_PATTERN.search(value):
+                return None
+            if value not in input_type:
+                choices = ", ".join(str(choice) for choice in input_type[:10])
+                more = "..." if len(input_type) > 10 else ""
+                return f"'{value}' is not one of: {choices}{more}"
+            return None
+
+        if input_type in PRIMITIVE_TYPES:
+            try:
+                value = PRIMITIVE_TYPES[input_type](value)
+            except (TypeError, ValueError, OverflowError):
+                return f"expects {input_type}, got {type(value).__name__} {value!r}"
+            if "min" in options and value < options["min"]:
+                return f"{value} is below the minimum of {options['min']}"
+            if "max" in options and value > options["max"]:
+                return f"{value} is above the maximum of {options['max']}"
+        return None
+
+    def raise_if_invalid(self, workflow):
+        errors = self.validate(workflow)
+        if errors:
+            raise ValueError(
+                "Your workflow is not valid for this version of ComfyUI and its custom nodes:\n"
+                + "\n".join(errors)
+            )